@@ -1,56 +1,530 @@
 import os
 import sys
 import time
+import re
+import json
+import threading
+import hashlib
 import argparse
-from typing import Optional
+from typing import List, Optional, Tuple
 
-try:
-    import ollama
-    import requests
-except ImportError:
-    print("Ollama or requests library not found. Please run 'pip install ollama requests'.", file=sys.stderr)
-    sys.exit(1)
+from cpp_chunker import GTEST_MACROS
+from llm_metrics import record_call
+from ollama_pool import get_pool, is_host_failure
 
 # --- CONFIGURATION ---
 OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_HOSTS = os.environ.get("OLLAMA_HOSTS", OLLAMA_HOST)  # Comma-separated; see ollama_pool.py
 OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "llama3")
+OLLAMA_NUM_CTX = int(os.environ.get("OLLAMA_NUM_CTX", "4096"))  # Size to fit prompt + RAG token budget + answer
+OLLAMA_TEMPERATURE = 0.1
+OLLAMA_SEED = int(os.environ["OLLAMA_SEED"]) if os.environ.get("OLLAMA_SEED") else None  # Fixed sampling seed
 MAX_RETRIES = 5
+STREAM = os.environ.get("OLLAMA_STREAM", "1") != "0"  # Stream tokens so generation can stop early
+MAX_TESTS = int(os.environ.get("OLLAMA_MAX_TESTS", "0"))  # Stop after this many complete TESTs (0 = no limit)
+# Opt-in response cache, e.g. ~/.cache/ai_generate_promt/responses.sqlite; "" disables it
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "")
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Batch mode: requests in flight at once; match the server's OLLAMA_NUM_PARALLEL
+MAX_IN_FLIGHT = int(os.environ.get("OLLAMA_MAX_IN_FLIGHT", "4"))
 
-def generate_content(prompt: str) -> Optional[str]:
-    """Calls the Ollama API to generate text content using exponential backoff."""
-    client = ollama.Client(host=OLLAMA_HOST)
+SYSTEM_MESSAGE = (
+    "You are an expert C++ unit test developer. "
+    "Return ONLY valid C++ GoogleTest code when asked for tests. "
+    "Rules: 1) Include necessary headers, 2) Each test is a separate TEST macro, "
+    "3) No nested TESTs, 4) Proper braces, 5) No markdown."
+)
+
+_TEST_HEADER_RE = re.compile(r'\b(?:' + '|'.join(GTEST_MACROS) + r')\s*\(')
+
+class TestStreamMonitor:
+    """Follows streamed C++ text and decides when generation can stop.
+
+    Braces are counted outside comments and string/char literals; a top-level
+    block whose header is a GoogleTest macro counts as a complete test once its
+    closing brace arrives. Stops when max_tests tests are complete or a stop
+    pattern appears; text() is then cut right after the last test or before
+    the pattern.
+    """
+
+    def __init__(self, max_tests: int = 0, stop_patterns: List[str] = ()):
+        self.max_tests = max_tests
+        self.stop_patterns = [re.compile(p) for p in stop_patterns]
+        self.tests = 0
+        self.buffer = ""
+        self.cut = None  # Offset the output is truncated at once stopped
+        self.reason = ""
+        self._pos = 0
+        self._depth = 0
+        self._state = "code"  # code | line_comment | block_comment | string | char
+        self._segment_start = 0  # Start of the current top-level statement or block header
+        self._in_test = False
+
+    def feed(self, text: str) -> bool:
+        """Adds streamed text; returns True once generation should stop."""
+        if self.cut is not None:
+            return True
+        self.buffer += text
+        for pattern in self.stop_patterns:
+            # Patterns may straddle chunk boundaries, so search the whole (short) answer
+            match = pattern.search(self.buffer)
+            if match:
+                self._stop(match.start(), f"stop pattern {pattern.pattern!r}")
+        self._scan(final=False)
+        return self.cut is not None
+
+    def finish(self) -> str:
+        """Scans the held-back tail once the stream has ended and returns the (cut) answer."""
+        self._scan(final=True)
+        return self.text()
+
+    def text(self) -> str:
+        return self.buffer if self.cut is None else self.buffer[:self.cut]
+
+    def _stop(self, offset: int, reason: str) -> None:
+        if self.cut is None or offset < self.cut:
+            self.cut = offset
+            self.reason = reason
+
+    def _scan(self, final: bool) -> None:
+        buf = self.buffer
+        i = self._pos
+        # Hold back a trailing character that may start a two-character token ("//", "*/", escapes)
+        end = len(buf) - 1 if not final and buf[-1:] in ('/', '*', '\\') else len(buf)
+        while i < end and (self.cut is None or i < self.cut):
+            c = buf[i]
+            nxt = buf[i + 1] if i + 1 < len(buf) else ""
+            if self._state == "line_comment":
+                if c == "\n":
+                    self._state = "code"
+            elif self._state == "block_comment":
+                if c == "*" and nxt == "/":
+                    self._state = "code"
+                    i += 1
+            elif self._state in ("string", "char"):
+                if c == "\\":
+                    i += 1
+                elif c == ('"' if self._state == "string" else "'") or c == "\n":
+                    self._state = "code"
+            elif c == "/" and nxt and nxt in "/*":
+                self._state = "line_comment" if nxt == "/" else "block_comment"
+                i += 1
+            elif c == '"':
+                self._state = "string"
+            elif c == "'" and not (i > 0 and buf[i - 1].isalnum() and nxt.isalnum()):
+                self._state = "char"
+            elif c == "{":
+                if self._depth == 0:
+                    self._in_test = bool(_TEST_HEADER_RE.search(buf[self._segment_start:i]))
+                self._depth += 1
+            elif c == "}" and self._depth:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._segment_start = i + 1
+                    if self._in_test:
+                        self.tests += 1
+                        self._in_test = False
+                        if self.max_tests and self.tests >= self.max_tests:
+                            self._stop(i + 1, f"--max-tests reached ({self.tests} complete)")
+            elif c == ";" and self._depth == 0:
+                self._segment_start = i + 1
+            i += 1
+        self._pos = i
+
+def clean_output(out: str) -> str:
+    return out.replace('```cpp', '').replace('```', '').strip()
+
+def note_chunk(stats: dict, part, start: float) -> None:
+    stats["stream_chunks"] = stats.get("stream_chunks", 0) + 1
+    stats.setdefault("first_token_ms", round((time.time() - start) * 1000, 1))
+    if part.get('done'):
+        stats["final"] = part
+
+def stream_chat(client, messages: List[dict], options: dict, monitor: TestStreamMonitor, stats: dict = None,
+                cancelled: threading.Event = None) -> str:
+    """Streams a chat completion into the monitor and closes the request as soon as it says stop.
+
+    If given, stats receives the chunk count, time to first chunk and the final
+    message carrying Ollama's token counts (absent when stopped early). Setting
+    cancelled (a hedged copy that lost, see OllamaPool.call) also closes it.
+    """
+    stats = {} if stats is None else stats
+    start = time.time()
+    stream = client.chat(model=OLLAMA_MODEL, messages=messages, options=options, stream=True)
+    try:
+        for part in stream:
+            if cancelled is not None and cancelled.is_set():
+                break
+            note_chunk(stats, part, start)
+            content = part['message']['content'] if 'message' in part else ''
+            if monitor.feed(content or ''):
+                stats["stopped_early"] = True
+                print(f"Stopped generation early: {monitor.reason}.")
+                break
+    finally:
+        # Closing the response disconnects from Ollama, which cancels the remaining generation
+        close = getattr(stream, 'close', None)
+        if close:
+            close()
+    return monitor.finish()
+
+async def stream_chat_async(client, messages: List[dict], options: dict, monitor: TestStreamMonitor,
+                            stats: dict = None) -> str:
+    """stream_chat for ollama.AsyncClient."""
+    stats = {} if stats is None else stats
+    start = time.time()
+    stream = await client.chat(model=OLLAMA_MODEL, messages=messages, options=options, stream=True)
+    try:
+        async for part in stream:
+            note_chunk(stats, part, start)
+            content = part['message']['content'] if 'message' in part else ''
+            if monitor.feed(content or ''):
+                stats["stopped_early"] = True
+                print(f"Stopped generation early: {monitor.reason}.")
+                break
+    finally:
+        aclose = getattr(stream, 'aclose', None)
+        if aclose:
+            await aclose()
+    return monitor.finish()
+
+class ResponseCache:
+    """Content-addressed on-disk cache of generated answers with size-bounded LRU eviction.
+
+    Keys are SHA-256 digests of everything that shapes the answer: model, system
+    message, prompt, sampling options and stop conditions. Backed by SQLite so
+    concurrent Jenkins jobs on one agent can share it.
+    """
+
+    def __init__(self, path: str, max_bytes: int = LLM_CACHE_MAX_BYTES):
+        import sqlite3
+
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, response TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, system_message: str, prompt: str, options: dict, stop: dict) -> str:
+        payload = json.dumps([model, system_message, prompt, options, stop], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row:
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return row[0] if row else None
+
+    def put(self, key: str, model: str, response: str) -> None:
+        """Stores an answer and evicts the least recently used ones above max_bytes."""
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses (key, model, response, size, created, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, model, response, len(response.encode("utf-8")), now, now)
+        )
+        (total,) = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if total > self.max_bytes:
+            doomed = []
+            for old_key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used ASC"):
+                if total <= self.max_bytes:
+                    break
+                doomed.append((old_key,))
+                total -= size
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self._conn.commit()
+
+def open_cache(path: str) -> Optional[ResponseCache]:
+    """Opens the response cache, or returns None (with a warning) if it is disabled or unusable."""
+    if not path:
+        return None
+    import sqlite3
+
+    try:
+        return ResponseCache(path)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Warning: response cache disabled ({e}).", file=sys.stderr)
+        return None
+
+def import_clients():
+    """Imports ollama on first use so --help and argument errors stay fast."""
+    try:
+        import ollama
+    except ImportError:
+        print("Ollama library not found. Please run 'pip install ollama'.", file=sys.stderr)
+        sys.exit(1)
+    return ollama
+
+def chat_options() -> dict:
+    options = {"temperature": OLLAMA_TEMPERATURE, "num_ctx": OLLAMA_NUM_CTX}
+    if OLLAMA_SEED is not None:
+        options["seed"] = OLLAMA_SEED
+    return options
+
+def generate_content(prompt: str, stream: bool = STREAM, max_tests: int = MAX_TESTS,
+                     stop_patterns: List[str] = (), cache: ResponseCache = None, refresh: bool = False,
+                     metadata: dict = None) -> Optional[str]:
+    """Returns the model's answer to the prompt, from the response cache if possible.
+
+    With refresh, the cache is not read but the new answer is stored. How the
+    answer was obtained is recorded in metadata (model, cache hit/miss/refresh/off).
+    """
+    options = chat_options()
+    metadata = metadata if metadata is not None else {}
+    key, cached = lookup_cached(cache, prompt, options, max_tests, stop_patterns, refresh, metadata)
+    if cached is not None:
+        return cached
+
+    start = time.time()
+    generated = call_ollama(prompt, options, stream, max_tests, stop_patterns)
+    metadata["generation_seconds"] = round(time.time() - start, 3)
+    if generated and cache is not None:
+        cache.put(key, OLLAMA_MODEL, generated)
+    return generated
+
+async def generate_content_async(pool, prompt: str, stream: bool = STREAM, max_tests: int = MAX_TESTS,
+                                 stop_patterns: List[str] = (), cache: ResponseCache = None, refresh: bool = False,
+                                 metadata: dict = None) -> Optional[str]:
+    """generate_content through an OllamaPool's async clients."""
+    options = chat_options()
+    metadata = metadata if metadata is not None else {}
+    key, cached = lookup_cached(cache, prompt, options, max_tests, stop_patterns, refresh, metadata)
+    if cached is not None:
+        return cached
+
+    start = time.time()
+    generated = await call_ollama_async(pool, prompt, options, stream, max_tests, stop_patterns)
+    metadata["generation_seconds"] = round(time.time() - start, 3)
+    if generated and cache is not None:
+        cache.put(key, OLLAMA_MODEL, generated)
+    return generated
+
+def lookup_cached(cache: Optional[ResponseCache], prompt: str, options: dict, max_tests: int,
+                  stop_patterns: List[str], refresh: bool, metadata: dict) -> Tuple[Optional[str], Optional[str]]:
+    """Returns (cache key, cached answer), both None with the cache off, and records the outcome in metadata."""
+    metadata.update({"model": OLLAMA_MODEL, "options": options, "cache": "off"})
+    if cache is None:
+        return None, None
+    key = ResponseCache.make_key(OLLAMA_MODEL, SYSTEM_MESSAGE, prompt, options,
+                                 {"max_tests": max_tests, "stop_patterns": list(stop_patterns)})
+    metadata["cache_key"] = key
+    cached = None if refresh else cache.get(key)
+    if cached is not None:
+        metadata["cache"] = "hit"
+        record_call("ai_generate_promt", "chat", OLLAMA_MODEL, prompt, 0.0, cache_hit=True)
+        print("Response cache hit; skipping generation.")
+        return key, cached
+    metadata["cache"] = "refresh" if refresh else "miss"
+    return key, None
+
+def record_chat(prompt: str, start: float, response, info: dict, retry: int, stats: dict = None,
+                error: str = "") -> None:
+    """Records one chat attempt; retries counts this backoff round (if any) plus hosts failed over to in the pool."""
+    stats = dict(stats or {})
+    stats.pop("final", None)
+    record_call("ai_generate_promt", "chat", OLLAMA_MODEL, prompt, time.time() - start, response,
+                host=info.get("host", ""), retries=min(retry, 1) + max(info.get("attempts", 1) - 1, 0),
+                hedged=info.get("hedged", False), error=error, attempt=retry + 1, **stats)
+
+def call_ollama(prompt: str, options: dict, stream: bool, max_tests: int,
+                stop_patterns: List[str]) -> Optional[str]:
+    """Calls the Ollama API to generate text content using exponential backoff.
+
+    When streaming, generation stops once max_tests complete TEST blocks have
+    arrived or a stop pattern (regex) appears; see TestStreamMonitor.
+    """
+    import_clients()
+    pool = get_pool(OLLAMA_HOSTS)
 
-    sys_msg = (
-        "You are an expert C++ unit test developer. "
-        "Return ONLY valid C++ GoogleTest code when asked for tests. "
-        "Rules: 1) Include necessary headers, 2) Each test is a separate TEST macro, "
-        "3) No nested TESTs, 4) Proper braces, 5) No markdown."
-    )
     messages = [
-        {"role": "system", "content": sys_msg},
+        {"role": "system", "content": SYSTEM_MESSAGE},
         {"role": "user", "content": prompt},
     ]
 
     for i in range(MAX_RETRIES):
+        info, stats = {}, {}
+        start = time.time()
         try:
-            resp = client.chat(
+            if stream:
+                # Each hedged copy streams into its own monitor and stats; only the winner's are kept
+                def stream_copy(client, cancelled: threading.Event):
+                    copy_stats = {}
+                    text = stream_chat(client, messages, options, TestStreamMonitor(max_tests, stop_patterns),
+                                       copy_stats, cancelled)
+                    return text, copy_stats
+
+                text, copy_stats = pool.call(stream_copy, info, cancellable=True)
+                stats.update(copy_stats)
+                answer = clean_output(text) or None
+                record_chat(prompt, start, stats.pop("final", None), info, i, stats)
+                return answer
+            resp = pool.call(lambda client: client.chat(
                 model=OLLAMA_MODEL,
                 messages=messages,
-                options={"temperature": 0.1, "num_ctx": 4096},
-            )
+                options=options,
+            ), info)
+            record_chat(prompt, start, resp, info, i)
             if resp and 'message' in resp and 'content' in resp['message']:
-                out = resp['message']['content']
-                return out.replace('```cpp', '').replace('```', '').strip()
+                return clean_output(resp['message']['content'])
             return None
-        except requests.exceptions.ConnectionError:
+        except Exception as e:
+            record_chat(prompt, start, None, info, i, stats, error=str(e) or type(e).__name__)
+            if not is_host_failure(e):
+                print(f"Error during Ollama API call: {e}", file=sys.stderr)
+                return None
             backoff = 2 ** i
             print(f"Ollama connection error. Retrying in {backoff}s...", file=sys.stderr)
             time.sleep(backoff)
-        except Exception as e:
-            print(f"Error during Ollama API call: {e}", file=sys.stderr)
+    return None
+
+async def call_ollama_async(pool, prompt: str, options: dict, stream: bool, max_tests: int,
+                            stop_patterns: List[str]) -> Optional[str]:
+    """call_ollama through an OllamaPool's async clients."""
+    import asyncio
+
+    messages = [
+        {"role": "system", "content": SYSTEM_MESSAGE},
+        {"role": "user", "content": prompt},
+    ]
+
+    for i in range(MAX_RETRIES):
+        info, stats = {}, {}
+        start = time.time()
+        try:
+            if stream:
+                # Each hedged copy streams into its own monitor and stats; only the winner's are kept
+                async def stream_copy(client):
+                    copy_stats = {}
+                    text = await stream_chat_async(client, messages, options,
+                                                   TestStreamMonitor(max_tests, stop_patterns), copy_stats)
+                    return text, copy_stats
+
+                text, copy_stats = await pool.acall(stream_copy, info)
+                stats.update(copy_stats)
+                answer = clean_output(text) or None
+                record_chat(prompt, start, stats.pop("final", None), info, i, stats)
+                return answer
+            resp = await pool.acall(lambda client: client.chat(model=OLLAMA_MODEL, messages=messages,
+                                                               options=options), info)
+            record_chat(prompt, start, resp, info, i)
+            if resp and 'message' in resp and 'content' in resp['message']:
+                return clean_output(resp['message']['content'])
             return None
+        except Exception as e:
+            record_chat(prompt, start, None, info, i, stats, error=str(e) or type(e).__name__)
+            if not is_host_failure(e):
+                print(f"Error during Ollama API call: {e}", file=sys.stderr)
+                return None
+            backoff = 2 ** i
+            print(f"Ollama connection error. Retrying in {backoff}s...", file=sys.stderr)
+            await asyncio.sleep(backoff)
     return None
 
+def read_prompt(prompt_file: str, requirements_file: str = None) -> str:
+    """Reads the prompt, with the optional requirements appended; raises OSError if the prompt is unreadable."""
+    with open(prompt_file, "r", encoding="utf-8") as f:
+        prompt = f.read()
+
+    if requirements_file and os.path.exists(requirements_file):
+        try:
+            with open(requirements_file, "r", encoding="utf-8") as f:
+                reqs = f.read()
+            prompt = f"{prompt}\n\nRequirements:\n{reqs}"
+        except Exception as e:
+            print(f"Warning: failed to read requirements file: {e}", file=sys.stderr)
+    return prompt
+
+def write_output(path: str, generated: Optional[str]) -> None:
+    """Writes the generated answer, or an error marker if generation failed."""
+    if not generated:
+        write_to_file(path, "// Error: generation failed\n")
+        return
+
+    # If generating tests, ensure headers exist
+    if '#include "number_to_string.h"' not in generated and 'TEST(' in generated:
+        generated = '#include "number_to_string.h"\n#include "gtest/gtest.h"\n\n' + generated
+
+    write_to_file(path, generated)
+
+def read_batch_manifest(path: str) -> List[dict]:
+    """Reads a JSONL file of {"prompt_file", "output_file", "requirements_file": optional, "id": optional}."""
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if not (isinstance(item, dict) and isinstance(item.get("prompt_file"), str)
+                    and isinstance(item.get("output_file"), str)):
+                raise ValueError(f"{path}:{line_number}: expected an object with 'prompt_file' and 'output_file'")
+            item.setdefault("id", str(len(items)))
+            items.append(item)
+    return items
+
+def run_batch(items: List[dict], max_in_flight: int = MAX_IN_FLIGHT, status_file: str = None,
+              **generate_options) -> int:
+    """Generates every manifest item concurrently, at most max_in_flight requests at a time.
+
+    Each output is written as soon as its answer is complete, and a status line
+    per item is printed and, with status_file, appended there as JSONL.
+    Returns the number of failed items.
+    """
+    import asyncio
+
+    import_clients()
+    pool = get_pool(OLLAMA_HOSTS)
+
+    async def run_all() -> List[dict]:
+        slots = asyncio.Semaphore(max(1, max_in_flight))
+        status_out = open(status_file, "w", encoding="utf-8") if status_file else None
+
+        async def run_item(item: dict) -> dict:
+            status = {"id": item["id"], "output_file": item["output_file"]}
+            try:
+                prompt = read_prompt(item["prompt_file"], item.get("requirements_file"))
+            except Exception as e:
+                status.update({"status": "failed", "error": f"failed to read prompt file: {e}"})
+            else:
+                # One item's failure (e.g. an unwritable output_file) must not cancel the others
+                try:
+                    async with slots:
+                        generated = await generate_content_async(pool, prompt, metadata=status, **generate_options)
+                    write_output(item["output_file"], generated)
+                    status["status"] = "ok" if generated else "failed"
+                except Exception as e:
+                    status.update({"status": "failed", "error": str(e) or type(e).__name__})
+            print(f"[{status['id']}] {status['status']}: {status['output_file']} "
+                  f"(cache {status.get('cache', 'off')}, {status.get('generation_seconds', 0.0):.1f}s)")
+            if status_out:
+                status_out.write(json.dumps(status) + "\n")
+                status_out.flush()
+            return status
+
+        try:
+            return await asyncio.gather(*(run_item(item) for item in items))
+        finally:
+            if status_out:
+                status_out.close()
+
+    results = asyncio.run(run_all())
+    failed = sum(1 for status in results if status["status"] != "ok")
+    print(f"Batch finished: {len(results) - failed} ok, {failed} failed.")
+    return failed
+
+def print_pool_report() -> None:
+    pool = get_pool(OLLAMA_HOSTS)
+    if len(pool.hosts) > 1:
+        print(pool.report())
+
 def write_to_file(path: str, content: str) -> None:
     """Writes the generated content to a file."""
     os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
@@ -59,36 +533,70 @@ def write_to_file(path: str, content: str) -> None:
 
 def main():
     parser = argparse.ArgumentParser(description="Generate text or C++ tests via Ollama.")
-    parser.add_argument("--prompt-file", required=True, help="File containing the prompt")
-    parser.add_argument("--output-file", required=True, help="Output file for generated content")
+    parser.add_argument("--prompt-file", help="File containing the prompt")
+    parser.add_argument("--output-file", help="Output file for generated content")
     parser.add_argument("--requirements-file", help="Optional requirements to append to the prompt")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", default=STREAM,
+                        help="Wait for the whole completion instead of streaming it")
+    parser.add_argument("--max-tests", type=int, default=MAX_TESTS,
+                        help="Stop streaming after this many complete TEST blocks (0 = no limit)")
+    parser.add_argument("--stop-pattern", dest="stop_patterns", action="append", default=[],
+                        help="Regex that ends the answer when it appears in the stream (repeatable)")
+    parser.add_argument("--cache-path", default=LLM_CACHE_PATH,
+                        help="SQLite response cache; identical requests are answered from it (default: off)")
+    parser.add_argument("--no-cache", action="store_true", help="Neither read nor write the response cache")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Regenerate even if cached, and store the new answer")
+    parser.add_argument("--metadata-file",
+                        help="JSON file recording model, options and cache use "
+                             "(default: <output-file>.meta.json when the cache is on); "
+                             "in batch mode, JSONL with one status line per item")
+    parser.add_argument("--batch",
+                        help="JSONL manifest of {prompt_file, output_file, requirements_file?, id?} "
+                             "items to generate concurrently")
+    parser.add_argument("--max-in-flight", type=int, default=MAX_IN_FLIGHT,
+                        help="Batch mode: concurrent requests to Ollama")
     args = parser.parse_args()
+    if not args.batch and not (args.prompt_file and args.output_file):
+        parser.error("--prompt-file and --output-file are required unless --batch is given")
+    for pattern in args.stop_patterns:
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            print(f"Invalid --stop-pattern {pattern!r}: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    cache = None if args.no_cache else open_cache(args.cache_path)
+    generate_options = {"stream": args.stream, "max_tests": args.max_tests, "stop_patterns": args.stop_patterns,
+                        "cache": cache, "refresh": args.refresh}
+    if args.batch:
+        try:
+            items = read_batch_manifest(args.batch)
+        except (OSError, ValueError) as e:
+            print(f"Failed to read batch manifest: {e}", file=sys.stderr)
+            sys.exit(1)
+        failed = run_batch(items, args.max_in_flight, args.metadata_file, **generate_options)
+        print_pool_report()
+        if failed:
+            sys.exit(1)
+        return
 
     try:
-        with open(args.prompt_file, "r", encoding="utf-8") as f:
-            prompt = f.read()
+        prompt = read_prompt(args.prompt_file, args.requirements_file)
     except Exception as e:
         print(f"Failed to read prompt file: {e}", file=sys.stderr)
         sys.exit(1)
 
-    if args.requirements_file and os.path.exists(args.requirements_file):
-        try:
-            with open(args.requirements_file, "r", encoding="utf-8") as f:
-                reqs = f.read()
-            prompt = f"{prompt}\n\nRequirements:\n{reqs}"
-        except Exception as e:
-            print(f"Warning: failed to read requirements file: {e}", file=sys.stderr)
-
-    generated = generate_content(prompt)
+    metadata = {}
+    generated = generate_content(prompt, metadata=metadata, **generate_options)
+    metadata_file = args.metadata_file or (f"{args.output_file}.meta.json" if cache is not None else None)
+    if metadata_file:
+        metadata["ok"] = bool(generated)
+        write_to_file(metadata_file, json.dumps(metadata, indent=2) + "\n")
+    write_output(args.output_file, generated)
+    print_pool_report()
     if not generated:
-        write_to_file(args.output_file, "// Error: generation failed\n")
         sys.exit(1)
 
-    # If generating tests, ensure headers exist
-    if '#include "number_to_string.h"' not in generated and 'TEST(' in generated:
-        generated = '#include "number_to_string.h"\n#include "gtest/gtest.h"\n\n' + generated
-
-    write_to_file(args.output_file, generated)
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
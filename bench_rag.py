@@ -0,0 +1,366 @@
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import List
+
+# --- CONFIGURATION ---
+SYNTHETIC_DIRS = 8  # Top-level directories the generated files are spread over
+EMBED_DIMENSION = 256
+WORDS = ("parse", "format", "number", "group", "buffer", "value", "index", "range", "token", "cache",
+         "string", "stream", "offset", "limit", "config", "report", "vector", "matrix", "node", "edge")
+# ---------------------
+
+
+def generate_tree(root: str, n_files: int, functions_per_file: int, seed: int = 0) -> List[str]:
+    """Writes a synthetic C++ tree (headers, sources with namespaces/classes, gtest files); returns relative paths."""
+    rng = random.Random(seed)
+    paths = []
+    for i in range(n_files):
+        directory = f"module_{i % SYNTHETIC_DIRS}"
+        stem = f"{rng.choice(WORDS)}_{i}"
+        kind = ("header", "source", "source", "test")[i % 4]
+        if kind == "header":
+            path = os.path.join(directory, "include", f"{stem}.h")
+        elif kind == "test":
+            path = os.path.join(directory, "tests", f"test_{stem}.cpp")
+        else:
+            path = os.path.join(directory, "src", f"{stem}.cpp")
+        os.makedirs(os.path.join(root, os.path.dirname(path)), exist_ok=True)
+        with open(os.path.join(root, path), 'w', encoding='utf-8') as f:
+            f.write(_synthetic_file(rng, kind, stem, functions_per_file))
+        paths.append(path)
+    return paths
+
+
+def _synthetic_file(rng: random.Random, kind: str, stem: str, functions: int) -> str:
+    class_name = ''.join(part.capitalize() for part in stem.split('_')[:-1]) + f"Helper{stem.split('_')[-1]}"
+    lines = ["#include <string>", "#include <vector>", ""]
+    if kind == "header":
+        lines += [f"namespace {stem.split('_')[0]} {{", "", f"class {class_name} {{", "public:"]
+        lines += [f"    int {rng.choice(WORDS)}{rng.choice(WORDS).capitalize()}{n}(int value) const;"
+                  for n in range(functions)]
+        lines += ["private:", "    std::vector<int> items_;", "};", "", "}  // namespace", ""]
+        return "\n".join(lines)
+    if kind == "test":
+        lines += ["#include <gtest/gtest.h>", ""]
+        for n in range(functions):
+            lines += [f"TEST({class_name}Test, Handles{rng.choice(WORDS).capitalize()}{n}) {{",
+                      f"    EXPECT_EQ({n}, {n});", "}", ""]
+        return "\n".join(lines)
+    lines += [f"namespace {stem.split('_')[0]} {{", ""]
+    for n in range(functions):
+        name = f"{rng.choice(WORDS)}{rng.choice(WORDS).capitalize()}{n}"
+        body_lines = rng.randint(3, 25)
+        lines += [f"// Computes the {rng.choice(WORDS)} of a {rng.choice(WORDS)}.",
+                  f"int {class_name}::{name}(int value) const {{", "    int result = value;"]
+        for b in range(body_lines):
+            lines.append(f"    if (result > {b * 7}) {{ result -= {rng.randint(1, 9)}; }}  // {rng.choice(WORDS)}")
+        lines += ["    return result;", "}", ""]
+    lines += ["}  // namespace", ""]
+    return "\n".join(lines)
+
+
+class FakeEmbeddingServer:
+    """Stand-in for Ollama's /api/embed and /api/embeddings with configurable latency.
+
+    Vectors are hashed bags of identifiers, so similar code gets similar vectors
+    and retrieval does real work. Runs on a background thread of this process.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, per_text_ms: float = 0.0, dimension: int = EMBED_DIMENSION):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.latency_ms = latency_ms
+        self.per_text_ms = per_text_ms
+        self.dimension = dimension
+        self.requests = 0
+        self.texts = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b'{}')
+                if self.path == "/api/embed":
+                    texts = payload.get("input") or []
+                    texts = [texts] if isinstance(texts, str) else texts
+                    body = {"model": payload.get("model"), "embeddings": [server.embed(t) for t in texts]}
+                elif self.path == "/api/embeddings":
+                    texts = [payload.get("prompt", "")]
+                    body = {"embedding": server.embed(texts[0])}
+                else:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                with server._lock:
+                    server.requests += 1
+                    server.texts += len(texts)
+                time.sleep((server.latency_ms + server.per_text_ms * len(texts)) / 1000)
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def embed(self, text: str) -> List[float]:
+        import zlib
+
+        vector = [0.0] * self.dimension
+        for token in re.findall(r'[A-Za-z_]\w*', text):
+            vector[zlib.crc32(token.lower().encode('utf-8')) % self.dimension] += 1.0
+        norm = sum(x * x for x in vector) ** 0.5 or 1.0
+        return [x / norm for x in vector]
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered) + 0.4999)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def directory_bytes(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            total += os.path.getsize(os.path.join(dirpath, name))
+    return total
+
+
+def run_worker(config: dict) -> dict:
+    """Indexes and queries in this (fresh) process; the environment configures rag_context_finder."""
+    import resource
+
+    import rag_context_finder
+
+    finder = rag_context_finder.LocalContextFinder(embed_batch_size=config["embed_batch_size"],
+                                                   backend=config["backend"], use_query_cache=False)
+    start = time.perf_counter()
+    stats = finder.index(config["files"], root=config["root"])
+    index_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    finder.index(config["files"], root=config["root"])
+    reindex_seconds = time.perf_counter() - start
+
+    latencies = []
+    for query in config["queries"]:
+        start = time.perf_counter()
+        finder.retrieve([query], config["k"])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+    parity = shard_parity(config, finder) if config.get("shard_parity") else None
+    line_numbers = line_number_invariance(config, finder)
+    return {
+        "chunks": stats["total"],
+        "index_seconds": round(index_seconds, 3),
+        "chunks_per_second": round(stats["total"] / index_seconds, 1) if index_seconds else 0.0,
+        "reindex_seconds": round(reindex_seconds, 3),
+        "query_p50_ms": round(percentile(latencies, 50), 2),
+        "query_p95_ms": round(percentile(latencies, 95), 2),
+        "peak_rss_mb": round(peak_mb, 1),
+        "shard_parity": parity,
+        "line_number_invariance": line_numbers,
+    }
+
+
+def shard_parity(config: dict, finder) -> dict:
+    """Per ranking mode, the share of queries a one-shard-per-directory index answers exactly like finder.
+
+    Sharding must not change results, so with the numpy backend (exact search)
+    every value should be 1.0. Chroma's HNSW search is approximate: for queries
+    far from every chunk (near-tied distances) a single index and its shards
+    can miss different neighbours, so its vector and hybrid values may be lower.
+    Runs after the timed part, on its own collection.
+    """
+    import rag_context_finder
+
+    sharded = rag_context_finder.ShardedContextFinder(1, embed_batch_size=config["embed_batch_size"],
+                                                      backend=config["backend"],
+                                                      collection=rag_context_finder.COLLECTION_NAME + "--parity",
+                                                      use_query_cache=False)
+    sharded.index(config["files"], root=config["root"])
+    modes = {"lexical": {"vector_weight": 0.0}, "vector": {"lexical_weight": 0.0}, "hybrid": {}}
+    parity = {}
+    for mode, options in modes.items():
+        single = finder.retrieve(config["queries"], config["k"], **options)
+        split = sharded.retrieve(config["queries"], config["k"], **options)
+        parity[mode] = round(sum(a == b for a, b in zip(single, split)) / max(1, len(single)), 3)
+    return parity
+
+
+def line_number_invariance(config: dict, finder) -> float:
+    """Share of queries with line numbers but no file whose lexical results match the query without them.
+
+    Line numbers are not searched for (they would match unrelated numeric
+    literals), so the value should be 1.0.
+    """
+    queries = [q for q in config["queries"] if "Line:" in q and "File:" not in q]
+    if not queries:
+        return 1.0
+    stripped = [re.sub(r'\b\d+\b', '', q) for q in queries]
+    with_lines = finder.retrieve(queries, config["k"], vector_weight=0.0)
+    without = finder.retrieve(stripped, config["k"], vector_weight=0.0)
+    return round(sum(a == b for a, b in zip(with_lines, without)) / len(queries), 3)
+
+
+def make_queries(files: List[str], root: str, count: int, seed: int = 0) -> List[str]:
+    """LCOV-style miss lists (direct line lookups), identifier queries (hybrid search) and identifier
+    queries carrying line numbers without a file (hybrid search, numbers must not matter), in turn."""
+    rng = random.Random(seed)
+    sources = [f for f in files if f.endswith(".cpp")] or files
+    queries = []
+    for i in range(count):
+        path = rng.choice(sources)
+        with open(os.path.join(root, path), 'r', encoding='utf-8') as f:
+            n_lines = sum(1 for _ in f)
+        lines = sorted(rng.sample(range(1, n_lines + 1), min(3, n_lines)))
+        words = f"{rng.choice(WORDS)}{rng.choice(WORDS).capitalize()} {rng.choice(WORDS)} value result"
+        if i % 3 == 0:
+            queries.append("\n".join(f"File: {path} Line: {line}" for line in lines))
+        elif i % 3 == 1:
+            queries.append(words)
+        else:
+            queries.append(words + "".join(f"\nLine: {line} (Uncovered)" for line in lines))
+    return queries
+
+
+def run_config(args, n_files: int, chunk_max_chars: int, backend: str, server: FakeEmbeddingServer) -> dict:
+    workdir = tempfile.mkdtemp(prefix="bench_rag_")
+    try:
+        root = os.path.join(workdir, "tree")
+        files = generate_tree(root, n_files, args.functions_per_file, seed=args.seed)
+        config = {
+            "root": root,
+            "files": files,
+            "queries": make_queries(files, root, args.queries, seed=args.seed),
+            "k": args.k,
+            "backend": backend,
+            "embed_batch_size": args.embed_batch_size,
+            "shard_parity": not args.skip_parity,
+        }
+        env = dict(os.environ, OLLAMA_HOST=server.url, OLLAMA_HOSTS=server.url,
+                   RAG_DB_PATH=os.path.join(workdir, "db"), CHUNK_MAX_CHARS=str(chunk_max_chars),
+                   RAG_BACKEND=backend, RAG_EMBEDDER="ollama", EMBED_CACHE_PATH="", RAG_QUERY_CACHE_PATH="")
+        requests_before, texts_before = server.requests, server.texts
+        here = os.path.dirname(os.path.abspath(__file__))
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker"], input=json.dumps(config),
+                              capture_output=True, text=True, env=env, cwd=here)
+        if proc.returncode != 0:
+            raise RuntimeError(f"worker failed for {n_files} files/{chunk_max_chars} chars/{backend}:\n{proc.stderr}")
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        result.update({
+            "files": n_files,
+            "chunk_max_chars": chunk_max_chars,
+            "backend": backend,
+            "source_bytes": directory_bytes(root),
+            "index_bytes": directory_bytes(os.path.join(workdir, "db")),
+            "embed_requests": server.requests - requests_before,
+            "embedded_texts": server.texts - texts_before,
+        })
+        return result
+    finally:
+        if args.keep:
+            print(f"Kept {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexing/retrieval benchmark on synthetic C++ trees "
+                                                 "against a local fake Ollama embedding server.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 400], help="Numbers of files to generate.")
+    parser.add_argument("--chunk-max-chars", type=int, nargs="+", default=[1500],
+                        help="CHUNK_MAX_CHARS values to compare.")
+    parser.add_argument("--backends", nargs="+", choices=["chroma", "numpy"], default=["numpy"],
+                        help="Vector store backends to compare.")
+    parser.add_argument("--functions-per-file", type=int, default=12)
+    parser.add_argument("--queries", type=int, default=50, help="Retrievals timed per configuration.")
+    parser.add_argument("--k", type=int, default=3, help="Snippets per retrieval.")
+    parser.add_argument("--embed-batch-size", type=int, default=64)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Fake server latency per request.")
+    parser.add_argument("--per-text-ms", type=float, default=0.5, help="Fake server latency per embedded text.")
+    parser.add_argument("--dimension", type=int, default=EMBED_DIMENSION, help="Fake embedding dimension.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the report to this JSON file.")
+    parser.add_argument("--skip-parity", action="store_true",
+                        help="Do not compare a sharded index's results with the single index's.")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated trees and indexes.")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        config = json.load(sys.stdin)
+        # Keep the worker's own progress output off the result line
+        real_stdout = sys.stdout
+        sys.stdout = sys.stderr
+        result = run_worker(config)
+        sys.stdout = real_stdout
+        print(json.dumps(result))
+        return
+
+    results = []
+    with FakeEmbeddingServer(args.latency_ms, args.per_text_ms, args.dimension) as server:
+        for backend in args.backends:
+            for chunk_max_chars in args.chunk_max_chars:
+                for n_files in args.sizes:
+                    try:
+                        result = run_config(args, n_files, chunk_max_chars, backend, server)
+                    except RuntimeError as e:
+                        print(f"Error: {e}", file=sys.stderr)
+                        sys.exit(1)
+                    results.append(result)
+                    print(f"{backend:>6} {n_files:>6} files, {chunk_max_chars:>5} chars: {result['chunks']} chunks, "
+                          f"{result['chunks_per_second']:.0f} chunks/s, reindex {result['reindex_seconds']:.2f}s, "
+                          f"query p50 {result['query_p50_ms']:.1f} ms / p95 {result['query_p95_ms']:.1f} ms, "
+                          f"RSS {result['peak_rss_mb']:.0f} MB, index {result['index_bytes'] / 1024:.0f} KiB")
+                    print(f"       line numbers ignored: {result['line_number_invariance']:.0%}")
+                    if result["shard_parity"]:
+                        print("       shard parity: " + ", ".join(f"{mode} {share:.0%}"
+                                                              for mode, share in result["shard_parity"].items()))
+
+    report = {
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "fake_server": {"latency_ms": args.latency_ms, "per_text_ms": args.per_text_ms, "dimension": args.dimension},
+        "queries_per_config": args.queries,
+        "k": args.k,
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
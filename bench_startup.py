@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+# --- CONFIGURATION ---
+# Entry points the pipeline calls, with arguments that exercise start-up only
+ENTRY_POINTS = {
+    "rag_context_finder.py": ["--help"],
+    "ai_generate_promt.py": ["--help"],
+    "summarize_code.py": ["--help"],
+    "llm_metrics.py": ["--help"],
+}
+# Modules that must only load in the code path that needs them
+HEAVY_MODULES = ("ollama", "chromadb", "torch", "sentence_transformers", "numpy", "requests", "httpx")
+IMPORT_BUDGET_MS = float(os.environ.get("STARTUP_IMPORT_BUDGET_MS", "150"))
+# ---------------------
+
+
+def parse_importtime(stderr: str) -> Dict[str, int]:
+    """Parses `python -X importtime` output into {module: self time in microseconds}."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, _cumulative, name = line[len("import time:"):].split("|", 2)
+        modules[name.strip()] = int(self_us)
+    return modules
+
+
+def measure(script: str, args: List[str], runs: int) -> dict:
+    """Runs the entry point `runs` times and keeps the fastest run (least scheduler noise)."""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", script] + args,
+                              capture_output=True, text=True)
+        wall_ms = (time.perf_counter() - start) * 1000
+        modules = parse_importtime(proc.stderr)
+        result = {
+            "script": script,
+            "exit_code": proc.returncode,
+            "wall_ms": round(wall_ms, 1),
+            "import_ms": round(sum(modules.values()) / 1000, 1),
+            "modules": modules,
+        }
+        if best is None or result["import_ms"] < best["import_ms"]:
+            best = result
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start-up (import time) benchmark for the Python entry points.")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per entry point; the fastest is reported.")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS,
+                        help="Fail if any entry point spends longer than this importing modules.")
+    parser.add_argument("--top", type=int, default=5, help="Number of slowest imports to list per entry point.")
+    parser.add_argument("--json", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    failures = []
+    results = []
+    for script, script_args in ENTRY_POINTS.items():
+        result = measure(os.path.join(here, script), script_args, args.runs)
+        result["script"] = script
+        heavy = sorted(m for m in result["modules"] if m.split(".")[0] in HEAVY_MODULES)
+        result["heavy_modules"] = heavy
+
+        print(f"{script}: imports {result['import_ms']:.1f} ms, wall {result['wall_ms']:.1f} ms")
+        slowest = sorted(result["modules"].items(), key=lambda item: -item[1])[:args.top]
+        for name, self_us in slowest:
+            print(f"    {self_us / 1000:7.1f} ms  {name}")
+
+        if result["exit_code"] != 0:
+            failures.append(f"{script} exited with {result['exit_code']}")
+        if heavy:
+            failures.append(f"{script} imports heavy modules at start-up: {', '.join(heavy)}")
+        if result["import_ms"] > args.budget_ms:
+            failures.append(f"{script} import time {result['import_ms']:.1f} ms exceeds budget {args.budget_ms:.1f} ms")
+        del result["modules"]
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"budget_ms": args.budget_ms, "results": results, "failures": failures}, f, indent=2)
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}", file=sys.stderr)
+        sys.exit(1)
+    print(f"OK: all entry points within {args.budget_ms:.1f} ms import budget.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+import bisect
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+# --- CONFIGURATION ---
+CPP_EXTENSIONS = ('.cpp', '.cc', '.cxx', '.c', '.h', '.hpp', '.hh', '.hxx')
+GTEST_MACROS = ('TEST', 'TEST_F', 'TEST_P', 'TYPED_TEST', 'TYPED_TEST_P')
+# ---------------------
+
+_NAMESPACE_RE = re.compile(r'(?:^|[\s;])(?:inline\s+)?namespace\b[\w:\s]*$|\bextern\s*"\s*"\s*$')
+_RECORD_RE = re.compile(r'\b(class|struct|union|enum)\s+(?:class\s+|struct\s+)?(?:\[\[[^\]]*\]\]\s*)?(\w+)')
+_CALLABLE_RE = re.compile(r'((?:~?[A-Za-z_]\w*\s*::\s*)*(?:operator\s*[^\s(]+|~?[A-Za-z_]\w*))\s*$')
+_NAMESPACE_NAME_RE = re.compile(r'namespace\s+([\w:]+)')
+
+
+class CodeChunk(NamedTuple):
+    """A piece of a source file with 1-based inclusive line range."""
+    text: str
+    start_line: int
+    end_line: int
+    kind: str    # function | class | test | declarations | fragment
+    symbol: str  # qualified name, "" when not applicable
+
+
+def mask_cpp(text: str) -> str:
+    """Returns text with comments and string/char literal contents blanked out.
+
+    The result has the same length and line breaks as the input, so offsets and
+    line numbers found in the mask are valid for the original text. Quote
+    characters themselves are kept.
+    """
+    out = list(text)
+    i = 0
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c == '/' and text.startswith('//', i):
+            j = text.find('\n', i)
+            j = n if j == -1 else j
+            # A backslash-newline continues a line comment
+            while j < n and j > 0 and text[j - 1] == '\\':
+                nxt = text.find('\n', j + 1)
+                j = n if nxt == -1 else nxt
+            _blank(out, i, j)
+            i = j
+        elif c == '/' and text.startswith('/*', i):
+            j = text.find('*/', i + 2)
+            j = n if j == -1 else j + 2
+            _blank(out, i, j)
+            i = j
+        elif c == 'R' and text.startswith('R"', i) and (i == 0 or not (text[i - 1].isalnum() or text[i - 1] == '_')):
+            open_paren = text.find('(', i + 2)
+            if open_paren == -1:
+                i += 1
+                continue
+            delimiter = ')' + text[i + 2:open_paren] + '"'
+            j = text.find(delimiter, open_paren)
+            j = n if j == -1 else j + len(delimiter)
+            _blank(out, i + 2, j - 1)
+            i = j
+        elif c in '"\'':
+            # Digit separators (1'000'000) are not char literals
+            if c == "'" and i > 0 and text[i - 1].isalnum() and i + 1 < n and text[i + 1].isalnum():
+                i += 1
+                continue
+            j = i + 1
+            while j < n and text[j] != c and text[j] != '\n':
+                j += 2 if text[j] == '\\' else 1
+            _blank(out, i + 1, min(j, n))
+            i = j + 1
+        else:
+            i += 1
+    return ''.join(out)
+
+
+def _blank(out: List[str], start: int, end: int) -> None:
+    for k in range(start, end):
+        if out[k] != '\n':
+            out[k] = ' '
+
+
+class _Unit(NamedTuple):
+    start: int
+    end: int
+    kind: str
+    symbol: str
+
+
+def _classify(header: str) -> str:
+    """Kind of the block whose opening brace follows the (masked) header text."""
+    stripped = header.strip()
+    if _NAMESPACE_RE.search(stripped):
+        return 'namespace'
+    if not stripped or stripped.endswith(('=', ',', '(', 'return')):
+        return 'init'
+    top_level = re.sub(r'\([^()]*\)', '()', stripped)
+    if 'operator' not in top_level and re.search(r'(?<![=!<>])=(?!=)', top_level):
+        # "auto f = [](int x) {" and other initializers
+        return 'init'
+    if '(' in stripped:
+        return 'function'
+    if _RECORD_RE.search(stripped):
+        return 'class'
+    return 'init'
+
+
+def _in_member_init_list(header: str) -> bool:
+    """True if a brace after this function header belongs to a constructor initializer list."""
+    close = header.rfind(')')
+    tail = header[close + 1:] if close != -1 else ''
+    # A single ':' after the parameter list starts the initializer list
+    colon = re.search(r'(?<!:):(?!:)', tail)
+    if close == -1 or not colon:
+        return False
+    before_brace = header.rstrip()
+    return bool(before_brace) and (before_brace[-1].isalnum() or before_brace[-1] in '_>')
+
+
+def _function_symbol(header: str) -> Tuple[str, str]:
+    """Returns (kind, symbol) for a function header."""
+    depth = 0
+    for pos, ch in enumerate(header):
+        if ch == '(' and depth == 0:
+            match = _CALLABLE_RE.search(header[:pos])
+            name = re.sub(r'\s+', '', match.group(1)) if match else ''
+            if name in GTEST_MACROS:
+                close = header.find(')', pos)
+                args = [a.strip() for a in header[pos + 1:close].split(',')]
+                return 'test', '.'.join(a for a in args[:2] if a)
+            return 'function', name
+        if ch in '<':
+            depth += 1
+        elif ch in '>' and depth:
+            depth -= 1
+    return 'function', ''
+
+
+def _find_units(masked: str) -> List[_Unit]:
+    """Splits masked C++ into top-level units, descending into namespaces."""
+    units: List[_Unit] = []
+    namespaces: List[str] = []
+    n = len(masked)
+    seg_start = 0           # start of the text not yet assigned to a unit
+    run_start: Optional[int] = None  # start of a pending run of declarations
+    block: Optional[dict] = None     # the opaque block currently being skipped
+    i = 0
+
+    def flush_run(end: int) -> None:
+        nonlocal run_start
+        if run_start is not None and masked[run_start:end].strip():
+            units.append(_Unit(run_start, end, 'declarations', '::'.join(namespaces)))
+        run_start = None
+
+    def end_statement(end: int) -> None:
+        nonlocal seg_start, run_start
+        if run_start is None:
+            run_start = seg_start
+        seg_start = end
+
+    while i < n:
+        c = masked[i]
+        if block is not None:
+            if c == '{':
+                block['depth'] += 1
+            elif c == '}':
+                block['depth'] -= 1
+                if block['depth'] == 0:
+                    end = i + 1
+                    if block['kind'] == 'init':
+                        # Brace initializer: still part of a declaration
+                        block = None
+                        i += 1
+                        continue
+                    if block['kind'] == 'class':
+                        # Include "} name;" after a type definition
+                        semi = masked.find(';', end)
+                        if semi != -1 and '{' not in masked[end:semi] and '}' not in masked[end:semi]:
+                            end = semi + 1
+                    units.append(_Unit(block['start'], end, block['kind'], block['symbol']))
+                    seg_start = end
+                    block = None
+                    i = end
+                    continue
+            i += 1
+            continue
+
+        if c == '#' and masked[masked.rfind('\n', 0, i) + 1:i].strip() == '':
+            # Preprocessor directive (with backslash continuations) is one statement
+            j = i
+            while True:
+                j = masked.find('\n', j)
+                if j == -1:
+                    j = n
+                    break
+                if masked[j - 1] != '\\':
+                    break
+                j += 1
+            end_statement(j)
+            i = j
+            continue
+        if c == ';':
+            end_statement(i + 1)
+        elif c == '{':
+            header = masked[seg_start:i]
+            kind = _classify(header)
+            if kind == 'namespace':
+                flush_run(seg_start)
+                match = _NAMESPACE_NAME_RE.search(header)
+                namespaces.append(match.group(1) if match else '')
+                seg_start = i + 1
+            elif kind == 'init' or (kind == 'function' and _in_member_init_list(header)):
+                block = {'depth': 1, 'kind': 'init'}
+            else:
+                flush_run(seg_start)
+                if kind == 'class':
+                    match = _RECORD_RE.search(header)
+                    symbol = match.group(2) if match else ''
+                else:
+                    kind, symbol = _function_symbol(header)
+                prefix = '::'.join(ns for ns in namespaces if ns)
+                if symbol and prefix and kind != 'test':
+                    symbol = f"{prefix}::{symbol}"
+                block = {'depth': 1, 'kind': kind, 'symbol': symbol, 'start': seg_start}
+        elif c == '}' and namespaces:
+            flush_run(seg_start)
+            namespaces.pop()
+            seg_start = i + 1
+        i += 1
+
+    if block is not None and block['kind'] != 'init':
+        # Unbalanced braces: keep the rest of the file as one unit
+        units.append(_Unit(block['start'], n, block['kind'], block['symbol']))
+    else:
+        if masked[seg_start:].strip():
+            end_statement(n)
+        flush_run(n)
+    return units
+
+
+def _split_text(text: str, budget: int) -> List[str]:
+    """Greedy line-based split of text into pieces of at most budget characters."""
+    pieces = []
+    current = ''
+    for line in text.splitlines(keepends=True):
+        while len(line) > budget:
+            if current:
+                pieces.append(current)
+                current = ''
+            pieces.append(line[:budget])
+            line = line[budget:]
+        if len(current) + len(line) > budget and current:
+            pieces.append(current)
+            current = ''
+        current += line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+class _LineIndex:
+    def __init__(self, text: str):
+        self.starts = [0] + [m.end() for m in re.finditer('\n', text)]
+
+    def line_of(self, offset: int) -> int:
+        return bisect.bisect_right(self.starts, offset)
+
+
+def _make_chunks(text: str, lines: _LineIndex, start: int, end: int,
+                 kind: str, symbol: str, max_chars: int) -> List[CodeChunk]:
+    body = text[start:end]
+    # Drop surrounding blank space but keep line numbers exact
+    lead = len(body) - len(body.lstrip())
+    body = body.strip()
+    if not body:
+        return []
+    start += lead
+    if len(body) <= max_chars:
+        return [CodeChunk(body, lines.line_of(start), lines.line_of(start + len(body) - 1), kind, symbol)]
+
+    chunks = []
+    offset = start
+    for piece in _split_text(body, max_chars):
+        piece_start = offset
+        offset += len(piece)
+        if piece.strip():
+            chunks.append(CodeChunk(piece.strip('\n'), lines.line_of(piece_start),
+                                    lines.line_of(offset - 1), 'fragment' if kind == 'declarations' else kind,
+                                    symbol))
+    return chunks
+
+
+def chunk_cpp(text: str, max_chars: int) -> List[CodeChunk]:
+    """Splits C/C++ source on function, class and namespace boundaries.
+
+    Each function or type definition becomes one chunk (with any comment right
+    above it); runs of declarations and preprocessor lines between them are
+    grouped. Only units longer than max_chars are sub-split, on line boundaries.
+    """
+    masked = mask_cpp(text)
+    lines = _LineIndex(text)
+    chunks = []
+    for unit in _find_units(masked):
+        chunks.extend(_make_chunks(text, lines, unit.start, unit.end, unit.kind, unit.symbol, max_chars))
+    return chunks
+
+
+def chunk_fixed(text: str, size: int) -> List[CodeChunk]:
+    """Fixed-size character windows, for files the structural chunker does not handle."""
+    lines = _LineIndex(text)
+    chunks = []
+    for i in range(0, len(text), size):
+        piece = text[i:i + size]
+        if piece.strip():
+            chunks.append(CodeChunk(piece, lines.line_of(i), lines.line_of(i + len(piece) - 1), 'fragment', ''))
+    return chunks
@@ -0,0 +1,164 @@
+import json
+import math
+import os
+import re
+import sys
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+# --- CONFIGURATION ---
+BM25_K1 = 1.2
+BM25_B = 0.75
+LEXICAL_INDEX_VERSION = 1
+# Tokens that occur everywhere in C++ sources or in LCOV miss lists
+STOPWORDS = frozenset({
+    "std", "const", "return", "int", "void", "include", "if", "else", "auto", "the",
+    "file", "line", "uncovered", "cpp", "h", "src",
+})
+# ---------------------
+
+_IDENTIFIER_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*|\d+')
+_SUBWORD_RE = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits identifiers on underscores and camelCase, keeping the whole identifier too.
+
+    "getNameVariant3" -> ["getnamevariant3", "get", "name", "variant", "3"]
+    """
+    tokens = []
+    for identifier in _IDENTIFIER_RE.findall(text):
+        parts = [p.lower() for piece in identifier.split('_') for p in _SUBWORD_RE.findall(piece)]
+        whole = identifier.lower()
+        if len(parts) > 1 and whole not in STOPWORDS:
+            tokens.append(whole)
+        tokens.extend(p for p in parts if p not in STOPWORDS)
+    return tokens
+
+
+def query_terms(query: str) -> List[str]:
+    """tokenize() without digit-only terms: miss-list line numbers would match arbitrary numeric literals."""
+    return [term for term in tokenize(query) if not term.isdigit()]
+
+
+class CorpusStats(NamedTuple):
+    """BM25 corpus statistics: document count, total token count and document frequency per term."""
+    n_docs: int
+    total_len: int
+    doc_freq: Dict[str, int]
+
+
+def merge_corpus_stats(parts: Iterable[CorpusStats]) -> CorpusStats:
+    """Statistics of the union of disjoint corpora, e.g. the shards of one index."""
+    n_docs = total_len = 0
+    doc_freq: Dict[str, int] = {}
+    for part in parts:
+        n_docs += part.n_docs
+        total_len += part.total_len
+        for term, df in part.doc_freq.items():
+            doc_freq[term] = doc_freq.get(term, 0) + df
+    return CorpusStats(n_docs, total_len, doc_freq)
+
+
+class LexicalIndex:
+    """BM25 inverted index over chunk tokens, persisted as JSON next to the manifest."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.doc_terms: Dict[str, Dict[str, int]] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_len: Dict[str, int] = {}
+        self._total_len = 0
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        index = cls(path)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return index
+        except (OSError, ValueError) as e:
+            print(f"Warning: ignoring unreadable lexical index {path}: {e}", file=sys.stderr)
+            return index
+        if data.get("version") == LEXICAL_INDEX_VERSION:
+            for chunk_id, terms in data["doc_terms"].items():
+                index._add_terms(chunk_id, terms)
+        return index
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": LEXICAL_INDEX_VERSION, "doc_terms": self.doc_terms}, f)
+        os.replace(tmp_path, self.path)
+
+    def __len__(self) -> int:
+        return len(self.doc_terms)
+
+    def add(self, chunk_id: str, text: str) -> None:
+        self.remove([chunk_id])
+        self._add_terms(chunk_id, dict(Counter(tokenize(text))))
+
+    def _add_terms(self, chunk_id: str, terms: Dict[str, int]) -> None:
+        self.doc_terms[chunk_id] = terms
+        self._doc_len[chunk_id] = sum(terms.values())
+        self._total_len += self._doc_len[chunk_id]
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[chunk_id] = tf
+
+    def remove(self, chunk_ids: Iterable[str]) -> None:
+        for chunk_id in chunk_ids:
+            terms = self.doc_terms.pop(chunk_id, None)
+            if terms is None:
+                continue
+            self._total_len -= self._doc_len.pop(chunk_id)
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(chunk_id, None)
+                    if not postings:
+                        del self._postings[term]
+
+    def corpus_stats(self, terms: Iterable[str]) -> CorpusStats:
+        """This index's statistics for the given terms, for merging with other shards."""
+        return CorpusStats(len(self.doc_terms), self._total_len,
+                           {term: len(self._postings.get(term, ())) for term in set(terms)})
+
+    def search(self, query: str, k: int, allowed: Set[str] = None,
+               corpus: Optional[CorpusStats] = None) -> List[Tuple[str, float]]:
+        """Returns up to k (chunk_id, BM25 score) pairs, best first; with allowed, only those chunks are scored.
+
+        IDF and the average document length come from corpus when given (see
+        merge_corpus_stats), so scores of different shards are comparable.
+        """
+        if not self.doc_terms:
+            return []
+        n_docs = corpus.n_docs if corpus is not None else len(self.doc_terms)
+        total_len = corpus.total_len if corpus is not None else self._total_len
+        avg_len = total_len / n_docs or 1.0
+        scores: Dict[str, float] = {}
+        for term, query_tf in Counter(query_terms(query)).items():
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            df = corpus.doc_freq.get(term, len(postings)) if corpus is not None else len(postings)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for chunk_id, tf in postings.items():
+                if allowed is not None and chunk_id not in allowed:
+                    continue
+                doc_len = self._doc_len[chunk_id]
+                norm = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_len / avg_len))
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * norm * query_tf
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+
+def reciprocal_rank_fusion(rankings: List[Tuple[List[str], float]], k: int) -> List[str]:
+    """Fuses ranked id lists, each with a weight: score(d) = sum(w / (k + rank)), rank from 1."""
+    scores: Dict[str, float] = {}
+    for ranked_ids, weight in rankings:
+        if weight <= 0:
+            continue
+        for rank, chunk_id in enumerate(ranked_ids, 1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + weight / (k + rank)
+    return [chunk_id for chunk_id, _ in sorted(scores.items(), key=lambda item: (-item[1], item[0]))]
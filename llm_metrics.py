@@ -0,0 +1,169 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List
+
+# --- CONFIGURATION ---
+# One JSON line per LLM / embedding call; "" disables recording
+LLM_METRICS_PATH = os.environ.get("LLM_METRICS_PATH", "")
+# Groups the records of one pipeline run; Jenkins sets BUILD_TAG
+LLM_METRICS_BUILD = os.environ.get("LLM_METRICS_BUILD", os.environ.get("BUILD_TAG", ""))
+# Ollama response fields copied into each record, durations converted from ns to ms
+OLLAMA_COUNTS = ("prompt_eval_count", "eval_count")
+OLLAMA_DURATIONS = ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration")
+# ---------------------
+
+_write_lock = threading.Lock()
+
+
+def _field(response, name: str):
+    try:
+        return response.get(name)
+    except AttributeError:
+        return None
+
+
+def record_call(script: str, kind: str, model: str, prompt: str, seconds: float, response=None, host: str = "",
+                retries: int = 0, cache_hit: bool = False, error: str = "", path: str = None, **extra) -> None:
+    """Appends one call record to the metrics file (LLM_METRICS_PATH); does nothing when it is unset.
+
+    response is the Ollama response (or final stream message); its token counts
+    and server-side durations are copied, and throughput is derived from them.
+    extra holds call-specific fields, e.g. the number of embedded inputs.
+    """
+    path = LLM_METRICS_PATH if path is None else path
+    if not path:
+        return
+    record = {
+        "ts": round(time.time(), 3),
+        "build": LLM_METRICS_BUILD,
+        "script": script,
+        "kind": kind,
+        "model": model,
+        "host": host,
+        "prompt_sha256": hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16],
+        "prompt_chars": len(prompt),
+        "wall_ms": round(seconds * 1000, 1),
+        "retries": retries,
+        "cache_hit": cache_hit,
+        "error": error,
+    }
+    if response is not None:
+        for name in OLLAMA_COUNTS:
+            record[name] = _field(response, name)
+        for name in OLLAMA_DURATIONS:
+            value = _field(response, name)
+            record[name.replace("_duration", "_ms")] = round(value / 1e6, 1) if value else None
+        if record.get("eval_count") and record.get("eval_ms"):
+            record["tokens_per_s"] = round(record["eval_count"] / (record["eval_ms"] / 1000), 1)
+        if record.get("prompt_eval_count") and record.get("prompt_eval_ms"):
+            record["prompt_tokens_per_s"] = round(record["prompt_eval_count"] / (record["prompt_eval_ms"] / 1000), 1)
+    record.update(extra)
+    line = json.dumps(record) + "\n"
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # One write per record in append mode, so concurrent scripts do not interleave lines
+        with _write_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        print(f"Warning: could not record LLM metrics to {path}: {e}", file=sys.stderr)
+
+
+def read_records(paths: List[str]) -> List[dict]:
+    records = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A run killed mid-write leaves a truncated last line
+                    print(f"Warning: skipping malformed line {path}:{line_number}", file=sys.stderr)
+    return records
+
+
+def _percentile(values: List[float], p: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+def summarize(records: List[dict], group_by: List[str]) -> List[dict]:
+    """Per group: call counts, token totals, embedding cache hits, wall-time total and percentiles, throughput."""
+    groups: Dict[tuple, List[dict]] = {}
+    for record in records:
+        groups.setdefault(tuple(record.get(key, "") for key in group_by), []).append(record)
+    rows = []
+    for key, members in sorted(groups.items()):
+        served = [r for r in members if not r.get("cache_hit") and not r.get("error")]
+        wall = [r["wall_ms"] for r in served if r.get("wall_ms") is not None]
+        eval_tokens = sum(r.get("eval_count") or 0 for r in served)
+        eval_ms = sum(r.get("eval_ms") or 0 for r in served if r.get("eval_count"))
+        rows.append({
+            **dict(zip(group_by, key)),
+            "calls": len(members),
+            "errors": sum(1 for r in members if r.get("error")),
+            "cache_hits": sum(1 for r in members if r.get("cache_hit")),
+            "retries": sum(r.get("retries") or 0 for r in members),
+            "hedged": sum(1 for r in members if r.get("hedged")),
+            "embed_cache_hits": sum(r.get("embed_cache_hits") or 0 for r in members),
+            "embed_cache_misses": sum(r.get("embed_cache_misses") or 0 for r in members),
+            "prompt_tokens": sum(r.get("prompt_eval_count") or 0 for r in served),
+            "output_tokens": eval_tokens,
+            "wall_s": round(sum(r.get("wall_ms") or 0 for r in members) / 1000, 2),
+            "load_s": round(sum(r.get("load_ms") or 0 for r in served) / 1000, 2),
+            "wall_p50_ms": _percentile(wall, 50),
+            "wall_p95_ms": _percentile(wall, 95),
+            "tokens_per_s": round(eval_tokens / (eval_ms / 1000), 1) if eval_ms else None,
+        })
+    return rows
+
+
+def print_summary(rows: List[dict], group_by: List[str]) -> None:
+    columns = group_by + ["calls", "errors", "cache_hits", "retries", "hedged", "prompt_tokens", "output_tokens",
+                          "wall_s", "load_s", "wall_p50_ms", "wall_p95_ms", "tokens_per_s"]
+    cells = [[("-" if row[c] is None else str(row[c])) for c in columns] for row in rows]
+    widths = [max([len(c)] + [len(r[i]) for r in cells]) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in cells:
+        print("  ".join(v.ljust(w) for v, w in zip(r, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize LLM / embedding call metrics (LLM_METRICS_PATH).")
+    parser.add_argument("files", nargs="*", help="Metrics JSONL files (default: LLM_METRICS_PATH)")
+    parser.add_argument("--build", help="Only records of this build (e.g. $BUILD_TAG)")
+    parser.add_argument("--group-by", default="build,script,kind,model",
+                        help="Comma-separated record fields to aggregate by (e.g. build,host)")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    files = args.files or ([LLM_METRICS_PATH] if LLM_METRICS_PATH else [])
+    if not files:
+        print("No metrics file given and LLM_METRICS_PATH is not set.", file=sys.stderr)
+        sys.exit(1)
+    try:
+        records = read_records(files)
+    except OSError as e:
+        print(f"Failed to read metrics: {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.build:
+        records = [r for r in records if r.get("build") == args.build]
+
+    group_by = [key.strip() for key in args.group_by.split(",") if key.strip()]
+    rows = summarize(records, group_by)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print_summary(rows, group_by)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+import json
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# --- CONFIGURATION ---
+VECTORS_FILE = "embeddings.npy"
+SCALES_FILE = "scales.npy"  # Per-row dequantization scale, int8 stores only
+METADATA_FILE = "metadata.json"
+STORE_VERSION = 2
+VECTOR_DTYPES = ("float32", "float16", "int8")
+SEARCH_BLOCK_ROWS = 16384  # Rows dequantized at a time, bounds the float32 scratch memory
+# ---------------------
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Scales each row to unit length so a dot product is the cosine similarity."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Converts float32 rows to the storage dtype; int8 also returns one scale per row."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == "float32":
+        return vectors, None
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        stored = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return stored, scales.astype(np.float32)
+    raise ValueError(f"Unsupported vector dtype {dtype!r}; expected one of {', '.join(VECTOR_DTYPES)}")
+
+
+def dequantize(stored: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    vectors = np.asarray(stored, dtype=np.float32)
+    if scales is not None:
+        vectors = vectors * np.asarray(scales)[:, None]
+    return vectors
+
+
+def score_all(queries: np.ndarray, stored: np.ndarray, scales: Optional[np.ndarray],
+              block_rows: int = SEARCH_BLOCK_ROWS) -> np.ndarray:
+    """Dot product of every query with every stored row, dequantizing block by block.
+
+    For int8 the per-row scale is applied to the block's scores rather than to
+    the block itself, which saves one full-size multiply.
+    """
+    scores = np.empty((queries.shape[0], stored.shape[0]), dtype=np.float32)
+    for start in range(0, stored.shape[0], block_rows):
+        block = np.asarray(stored[start:start + block_rows], dtype=np.float32)
+        block_scores = queries @ block.T
+        if scales is not None:
+            block_scores *= scales[start:start + block_rows]
+        scores[:, start:start + block.shape[0]] = block_scores
+    return scores
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the k highest scores per row, best first.
+
+    argpartition finds the candidates in O(n); only those k are sorted. Ties are
+    broken by row position so results are deterministic.
+    """
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(n), (scores.shape[0], 1))
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.lexsort((candidates, -candidate_scores), axis=1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def matches_where(metadata: dict, where: Optional[dict]) -> bool:
+    """Evaluates a ChromaDB-style metadata filter: field equality, $eq/$ne/$in/$nin, $and/$or."""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        else:
+            value = metadata.get(key)
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for op, operand in condition.items():
+                if op == "$eq":
+                    ok = value == operand
+                elif op == "$ne":
+                    ok = value != operand
+                elif op == "$in":
+                    ok = value in operand
+                elif op == "$nin":
+                    ok = value not in operand
+                else:
+                    raise ValueError(f"Unsupported where operator {op!r}")
+                if not ok:
+                    return False
+    return True
+
+
+def quantization_report(vectors: np.ndarray, queries: np.ndarray, k: int) -> List[dict]:
+    """Recall@k, size and search time of each storage dtype against exact float32 search."""
+    vectors = normalize_rows(vectors)
+    queries = normalize_rows(queries)
+    reference = top_k(score_all(queries, vectors, None), k)
+    report = []
+    for dtype in VECTOR_DTYPES:
+        stored, scales = quantize(vectors, dtype)
+        start = time.perf_counter()
+        found = top_k(score_all(queries, stored, scales), k)
+        elapsed = time.perf_counter() - start
+        overlap = [len(set(ref) & set(got)) / max(1, len(ref)) for ref, got in zip(reference.tolist(), found.tolist())]
+        size = stored.nbytes + (scales.nbytes if scales is not None else 0)
+        report.append({
+            "dtype": dtype,
+            "recall_at_k": round(float(np.mean(overlap)), 4) if overlap else 1.0,
+            "bytes_per_vector": round(size / max(1, len(vectors)), 1),
+            "index_bytes": int(size),
+            "search_ms": round(elapsed * 1000, 2),
+        })
+    return report
+
+
+class _State(NamedTuple):
+    """One consistent version of the collection; rows line up across all fields."""
+    ids: List[str]
+    documents: List[str]
+    metadatas: List[dict]
+    vectors: Optional[np.ndarray]  # View of the first len(ids) rows of the vector buffer
+    scales: Optional[np.ndarray]
+
+
+_EMPTY = _State([], [], [], None, None)
+
+
+class NumpyCollection:
+    """Exact-search vector store with the subset of the ChromaDB Collection API this repo uses.
+
+    Unit-length embeddings live in a memory-mapped .npy matrix, stored as float32,
+    float16 or int8 (with a per-row scale); ids, documents and metadata live in a
+    JSON sidecar with the same row order. The directory is self-contained, so it
+    can be copied between agents as is. Distances returned by query() are cosine
+    distances (1 - similarity).
+
+    Writes are persisted immediately unless called with persist=False; bulk
+    loaders pass that on every batch and call save() once at the end.
+
+    Reads work on a snapshot (_State) that is never modified after it is
+    published, so they can run in other threads while a write is in progress.
+    Writes are serialized by a lock, build the next snapshot and swap it in with a
+    single assignment: appended vectors go into rows of the buffer no snapshot
+    covers yet, and replacing vectors of existing rows copies the buffer first.
+    """
+
+    def __init__(self, path: str, embedding_function: Callable[[List[str]], List[List[float]]],
+                 embedding_model: str = "", dtype: str = "float32"):
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unsupported vector dtype {dtype!r}; expected one of {', '.join(VECTOR_DTYPES)}")
+        self.path = path
+        self.embedding_function = embedding_function
+        self.embedding_model = embedding_model
+        self.dtype = dtype
+        self._write_lock = threading.Lock()
+        self._load()
+
+    # --- persistence ---
+
+    def _load(self) -> None:
+        self._state = _EMPTY
+        # Growable storage behind the snapshot's vectors/scales, allocated on the first write
+        self._vector_buffer: Optional[np.ndarray] = None
+        self._scale_buffer: Optional[np.ndarray] = None
+        self._dirty = False
+        meta_path = os.path.join(self.path, METADATA_FILE)
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if (meta.get("store_version") != STORE_VERSION or meta.get("embedding_model") != self.embedding_model
+                or meta.get("dtype") != self.dtype):
+            print(f"Ignoring numpy index at {self.path}: built with a different store version, model or dtype.",
+                  file=sys.stderr)
+            return
+        vectors = scales = None
+        if meta["ids"]:
+            # Memory-mapped: cold start only touches the pages a query reads
+            vectors = np.load(os.path.join(self.path, VECTORS_FILE), mmap_mode='r')
+            if self.dtype == "int8":
+                scales = np.load(os.path.join(self.path, SCALES_FILE))
+            if (vectors.shape[0] != len(meta["ids"]) or vectors.shape[1] != meta.get("dimension", vectors.shape[1])
+                    or (scales is not None and scales.shape[0] != len(meta["ids"]))):
+                print(f"Ignoring numpy index at {self.path}: vectors and metadata disagree.", file=sys.stderr)
+                return
+        self._state = _State(meta["ids"], meta["documents"], meta["metadatas"], vectors, scales)
+
+    def save(self) -> None:
+        """Writes changes made with persist=False to disk."""
+        with self._write_lock:
+            if self._dirty:
+                self._save()
+
+    def _save(self) -> None:
+        state = self._state
+        os.makedirs(self.path, exist_ok=True)
+        if state.vectors is not None:
+            self._save_array(VECTORS_FILE, state.vectors)
+            if state.scales is not None:
+                self._save_array(SCALES_FILE, state.scales)
+        meta_path = os.path.join(self.path, METADATA_FILE)
+        meta = {
+            "store_version": STORE_VERSION,
+            "embedding_model": self.embedding_model,
+            "dtype": self.dtype,
+            "dimension": int(state.vectors.shape[1]) if state.vectors is not None else 0,
+            "ids": state.ids,
+            "documents": state.documents,
+            "metadatas": state.metadatas,
+        }
+        with open(meta_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        # Metadata last: a crash in between leaves a row-count mismatch that _load rejects
+        os.replace(meta_path + ".tmp", meta_path)
+        self._dirty = False
+
+    def _save_array(self, name: str, array: np.ndarray) -> None:
+        path = os.path.join(self.path, name)
+        with open(path + ".tmp", 'wb') as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(path + ".tmp", path)
+
+    # --- Collection API ---
+
+    def count(self) -> int:
+        return len(self._state.ids)
+
+    def get(self, ids: List[str] = None, include: List[str] = ('documents', 'metadatas')) -> dict:
+        state = self._state
+        if ids is None:
+            rows = range(len(state.ids))
+        else:
+            positions = self._positions(state)
+            rows = [positions[i] for i in ids if i in positions]
+        return self._rows_result(state, list(rows), include)
+
+    def upsert(self, documents: List[str], metadatas: List[dict], ids: List[str],
+               embeddings: List[List[float]] = None, persist: bool = True) -> None:
+        if not ids:
+            return
+        if embeddings is None:
+            embeddings = self.embedding_function(list(documents))
+        new_vectors, new_scales = quantize(normalize_rows(embeddings), self.dtype)
+        with self._write_lock:
+            state = self._state
+            if state.vectors is not None and state.vectors.shape[1] != new_vectors.shape[1]:
+                raise ValueError(f"Embedding dimension {new_vectors.shape[1]} does not match index "
+                                 f"({state.vectors.shape[1]})")
+            positions = self._positions(state)
+            count = len(state.ids)
+            # New lists, so readers holding the current snapshot never see a half-applied batch
+            all_ids, all_documents, all_metadatas = list(state.ids), list(state.documents), list(state.metadatas)
+            appended = []
+            replaced = []  # (position, row of the new vectors)
+            for row, (chunk_id, doc, meta) in enumerate(zip(ids, documents, metadatas)):
+                if chunk_id in positions:
+                    pos = positions[chunk_id]
+                    replaced.append((pos, row))
+                    all_documents[pos] = doc
+                    all_metadatas[pos] = meta
+                else:
+                    positions[chunk_id] = len(all_ids)
+                    all_ids.append(chunk_id)
+                    all_documents.append(doc)
+                    all_metadatas.append(meta)
+                    appended.append(row)
+
+            self._reserve(state, len(all_ids), new_vectors, new_scales,
+                          copy=any(pos < count for pos, _ in replaced))
+            # Appends first: a chunk id repeated within the batch replaces its own just-appended row
+            for target, rows in ((slice(count, len(all_ids)), appended),
+                                 ([pos for pos, _ in replaced], [row for _, row in replaced])):
+                if rows:
+                    self._vector_buffer[target] = new_vectors[rows]
+                    if new_scales is not None:
+                        self._scale_buffer[target] = new_scales[rows]
+            scales = self._scale_buffer[:len(all_ids)] if self._scale_buffer is not None else None
+            self._state = _State(all_ids, all_documents, all_metadatas, self._vector_buffer[:len(all_ids)], scales)
+            self._dirty = True
+            if persist:
+                self._save()
+
+    add = upsert
+
+    def delete(self, ids: List[str], persist: bool = True) -> None:
+        doomed = set(ids)
+        with self._write_lock:
+            state = self._state
+            keep = [row for row, chunk_id in enumerate(state.ids) if chunk_id not in doomed]
+            if len(keep) == len(state.ids):
+                return
+            # Fancy indexing copies, so the buffers are new and the old snapshot stays intact
+            self._vector_buffer = np.array(state.vectors[keep]) if keep else None
+            self._scale_buffer = np.array(state.scales[keep]) if keep and state.scales is not None else None
+            self._state = _State([state.ids[row] for row in keep], [state.documents[row] for row in keep],
+                                 [state.metadatas[row] for row in keep], self._vector_buffer, self._scale_buffer)
+            self._dirty = True
+            if persist:
+                self._save()
+
+    def query(self, query_texts: List[str] = None, query_embeddings: List[List[float]] = None,
+              n_results: int = 10,
+              include: List[str] = ('documents', 'metadatas', 'distances'), where: dict = None) -> dict:
+        if query_embeddings is None:
+            query_embeddings = self.embedding_function(list(query_texts))
+        queries = normalize_rows(query_embeddings)
+        state = self._state
+        result: Dict[str, list] = {key: [] for key in ['ids', *include]}
+        candidates = None
+        if where and state.vectors is not None:
+            candidates = np.array([row for row, meta in enumerate(state.metadatas) if matches_where(meta, where)],
+                                  dtype=np.int64)
+        if state.vectors is None or (candidates is not None and not candidates.size):
+            for key in result:
+                result[key] = [[] for _ in range(len(queries))]
+            return result
+
+        # One (blocked) matrix product scores every candidate chunk against every query
+        if candidates is None:
+            scores = score_all(queries, state.vectors, state.scales)
+        else:
+            scales = state.scales[candidates] if state.scales is not None else None
+            scores = score_all(queries, state.vectors[candidates], scales)
+        best = top_k(scores, n_results)
+        for q, columns in enumerate(best):
+            columns = columns.tolist()
+            rows = candidates[columns].tolist() if candidates is not None else columns
+            single = self._rows_result(state, rows, include)
+            for key in single:
+                result[key].append(single[key])
+            if 'distances' in include:
+                result['distances'].append((1.0 - scores[q, columns]).tolist())
+        return result
+
+    # --- helpers ---
+
+    def _reserve(self, state: _State, rows: int, like: np.ndarray, like_scales: Optional[np.ndarray],
+                 copy: bool) -> None:
+        """Makes the buffers hold at least rows rows; capacity doubles, so appends are amortized O(1).
+
+        With copy, the buffers are always reallocated, so rows the current
+        snapshot covers can be overwritten without readers seeing it.
+        """
+        if not copy and self._vector_buffer is not None and self._vector_buffer.shape[0] >= rows:
+            return
+        current = self._vector_buffer.shape[0] if self._vector_buffer is not None else 0
+        capacity = max(rows, 2 * current) if current < rows else current
+        vectors = np.empty((capacity, like.shape[1]), dtype=like.dtype)
+        scales = np.empty(capacity, dtype=np.float32) if like_scales is not None else None
+        # Copies the memory-mapped matrix once, on the first write after loading
+        if state.vectors is not None:
+            vectors[:state.vectors.shape[0]] = state.vectors
+            if scales is not None:
+                scales[:state.scales.shape[0]] = state.scales
+        self._vector_buffer = vectors
+        self._scale_buffer = scales
+
+    @staticmethod
+    def _positions(state: _State) -> Dict[str, int]:
+        return {chunk_id: row for row, chunk_id in enumerate(state.ids)}
+
+    @staticmethod
+    def _rows_result(state: _State, rows: List[int], include) -> dict:
+        result = {'ids': [state.ids[r] for r in rows]}
+        if 'documents' in include:
+            result['documents'] = [state.documents[r] for r in rows]
+        if 'metadatas' in include:
+            result['metadatas'] = [state.metadatas[r] for r in rows]
+        if 'embeddings' in include:
+            scales = state.scales[rows] if state.scales is not None else None
+            result['embeddings'] = dequantize(state.vectors[rows], scales).tolist() if rows else []
+        return result
@@ -0,0 +1,344 @@
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+# --- CONFIGURATION ---
+# Hedge a request to a second host once it has run longer than this percentile of
+# the first host's recent latencies (e.g. 95); 0 disables hedging
+HEDGE_PERCENTILE = float(os.environ.get("OLLAMA_HEDGE_PERCENTILE", "0"))
+HEDGE_MIN_SAMPLES = 20  # Latencies a host needs before its percentile is trusted
+LATENCY_WINDOW = 200  # Recent latencies kept per host
+HOST_RETRY_AFTER = float(os.environ.get("OLLAMA_HOST_RETRY_AFTER", "30"))  # Seconds a failed host is skipped
+HEALTH_TIMEOUT = 2.0  # Seconds for the /api/version probe of a host coming back
+# ---------------------
+
+
+def parse_hosts(value: str) -> List[str]:
+    """Splits a comma- or whitespace-separated host list ("http://gpu1:11434,http://gpu2:11434")."""
+    return list(dict.fromkeys(h.strip().rstrip('/') for h in value.replace(',', ' ').split() if h.strip()))
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+def is_host_failure(error: Exception) -> bool:
+    """True for connection problems and server-side errors, which say nothing about the request itself."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    status = getattr(error, 'status_code', None)
+    if isinstance(status, int) and status >= 500:
+        return True
+    try:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(error, httpx.TransportError)
+
+
+class _Host:
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.failures = 0
+        self.hedges = 0  # Requests this host received as the second copy of a slow one
+        self.down_until = 0.0  # monotonic time before which the host is skipped
+        self.suspect = False  # Failed last time: probe before the next request
+        self.client = None
+        self.async_client = None
+
+
+class OllamaPool:
+    """Spreads Ollama requests over several hosts.
+
+    Each request goes to the healthy host with the fewest requests in flight
+    (ties: the lower median latency). A host that fails with a connection error
+    or a 5xx response is skipped for retry_after seconds and probed before it is
+    used again; the request fails over to the next host. With hedge_percentile, a
+    request still running after that percentile of its host's recent latencies
+    is also sent to a second host and the first answer wins. call() and acall()
+    take a function of an ollama.Client / ollama.AsyncClient, so any endpoint
+    (chat, embed, streaming) can go through the pool.
+    """
+
+    def __init__(self, hosts: List[str], hedge_percentile: float = HEDGE_PERCENTILE,
+                 retry_after: float = HOST_RETRY_AFTER):
+        if not hosts:
+            raise ValueError("OllamaPool needs at least one host")
+        self.hosts = [_Host(url) for url in hosts]
+        self.hedge_percentile = hedge_percentile
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+
+    # --- routing ---
+
+    def _acquire(self, exclude) -> Optional[_Host]:
+        """Picks and reserves the least-busy available host, or None if none is left."""
+        now = time.monotonic()
+        with self._lock:
+            ready = [h for h in self.hosts if h not in exclude and h.down_until <= now]
+            if not ready and not exclude:
+                # Everything is marked down: give all hosts another chance rather than fail outright
+                ready = [h for h in self.hosts if h not in exclude]
+        ready = [h for h in ready if not h.suspect or self._probe(h)]
+        with self._lock:
+            if not ready:
+                return None
+            host = min(ready, key=lambda h: (h.outstanding, self._median(h), self.hosts.index(h)))
+            host.outstanding += 1
+            return host
+
+    def _release(self, host: _Host, elapsed: float = None, error: Exception = None) -> None:
+        """Frees the host's slot and records the outcome; neither elapsed nor error means cancelled."""
+        with self._lock:
+            host.outstanding -= 1
+            if elapsed is not None:
+                host.requests += 1
+                host.latencies.append(elapsed)
+                host.suspect = False
+            elif error is not None and is_host_failure(error):
+                host.failures += 1
+                host.suspect = True
+                host.down_until = time.monotonic() + self.retry_after
+
+    def _probe(self, host: _Host) -> bool:
+        import urllib.error
+        import urllib.request
+
+        try:
+            with urllib.request.urlopen(f"{host.url}/api/version", timeout=HEALTH_TIMEOUT) as response:
+                ok = response.status == 200
+        except (OSError, urllib.error.URLError):
+            ok = False
+        with self._lock:
+            host.suspect = not ok
+            if not ok:
+                host.down_until = time.monotonic() + self.retry_after
+        return ok
+
+    @staticmethod
+    def _median(host: _Host) -> float:
+        return percentile(list(host.latencies), 50) if host.latencies else 0.0
+
+    def _hedge_delay(self, host: _Host) -> Optional[float]:
+        if self.hedge_percentile <= 0 or len(self.hosts) < 2:
+            return None
+        with self._lock:
+            samples = list(host.latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return percentile(samples, self.hedge_percentile)
+
+    def _client(self, host: _Host):
+        if host.client is None:
+            import ollama
+
+            host.client = ollama.Client(host=host.url)
+        return host.client
+
+    def _async_client(self, host: _Host):
+        if host.async_client is None:
+            import ollama
+
+            host.async_client = ollama.AsyncClient(host=host.url)
+        return host.async_client
+
+    def _failed_over(self, host: _Host, error: Exception) -> None:
+        print(f"Ollama host {host.url} failed ({error}); trying another host.", file=sys.stderr)
+
+    # --- requests ---
+
+    def call(self, fn: Callable, info: dict = None, cancellable: bool = False):
+        """Returns fn(client) from the first host that answers; re-raises errors of the request itself.
+
+        If given, info receives the answering (or last failing) "host", the
+        number of hosts "attempts"-ed one after another (1 + failovers) and
+        whether a "hedged" second copy was sent; hedges are not attempts.
+
+        A hedged copy that loses keeps running in a background thread, so by
+        default fn must be free of side effects the caller sees (embedding and
+        non-streaming chat calls are). With cancellable, fn is called as
+        fn(client, cancelled), each copy with its own threading.Event that is set
+        once another copy has answered; fn should then stop early (e.g. close its
+        stream), and whatever it returns is discarded.
+        """
+        info = {} if info is None else info
+        info.setdefault("hedged", False)
+        tried = set()
+        hedges = 0
+        last_error = None
+        while True:
+            host = self._acquire(tried)
+            if host is None:
+                raise last_error or ConnectionError(f"No Ollama host available ({', '.join(self.hostnames())})")
+            tried.add(host)
+            delay = self._hedge_delay(host)
+            launched = 1
+            answers = queue.Queue()
+            copies: List[threading.Event] = []  # Per-copy cancel flags
+
+            def run(target: _Host, cancelled: threading.Event) -> None:
+                start = time.monotonic()
+                try:
+                    result = fn(self._client(target), cancelled) if cancellable else fn(self._client(target))
+                except Exception as e:
+                    self._release(target, error=None if cancelled.is_set() else e)
+                    answers.put((target, None, e))
+                    return
+                if cancelled.is_set():
+                    # Lost the race and stopped early: its latency says nothing about the host
+                    self._release(target)
+                    return
+                self._release(target, time.monotonic() - start)
+                answers.put((target, result, None))
+
+            def launch(target: _Host) -> None:
+                copies.append(threading.Event())
+                # Daemon threads: a losing copy must not keep a one-shot script from exiting
+                threading.Thread(target=run, args=(target, copies[-1]), daemon=True).start()
+
+            if delay is None:
+                copies.append(threading.Event())
+                run(host, copies[-1])
+            else:
+                launch(host)
+            try:
+                answer = answers.get(timeout=delay)
+            except queue.Empty:
+                backup = self._acquire(tried)
+                if backup is not None:
+                    tried.add(backup)
+                    backup.hedges += 1
+                    hedges += 1
+                    info["hedged"] = True
+                    launched += 1
+                    launch(backup)
+                answer = answers.get()
+            remaining = launched
+            try:
+                while True:
+                    target, result, error = answer
+                    remaining -= 1
+                    info.update(host=target.url, attempts=len(tried) - hedges)
+                    if error is None:
+                        return result
+                    if not is_host_failure(error):
+                        raise error
+                    self._failed_over(target, error)
+                    last_error = error
+                    if not remaining:
+                        break
+                    answer = answers.get()
+            finally:
+                # Tells a still-running copy that its answer is no longer wanted
+                for cancelled in copies:
+                    cancelled.set()
+
+    async def acall(self, fn: Callable, info: dict = None):
+        """call() for coroutines: awaits fn(async_client); a hedged copy that loses is cancelled."""
+        import asyncio
+
+        info = {} if info is None else info
+        info.setdefault("hedged", False)
+
+        async def run(target: _Host):
+            start = time.monotonic()
+            try:
+                result = await fn(self._async_client(target))
+            except asyncio.CancelledError:
+                self._release(target)
+                raise
+            except Exception as e:
+                self._release(target, error=e)
+                raise
+            self._release(target, time.monotonic() - start)
+            return result
+
+        tried = set()
+        hedges = 0
+        last_error = None
+        while True:
+            host = self._acquire(tried)
+            if host is None:
+                raise last_error or ConnectionError(f"No Ollama host available ({', '.join(self.hostnames())})")
+            tried.add(host)
+            tasks: Dict[asyncio.Task, _Host] = {asyncio.ensure_future(run(host)): host}
+            delay = self._hedge_delay(host)
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                backup = self._acquire(tried)
+                if backup is not None:
+                    tried.add(backup)
+                    backup.hedges += 1
+                    hedges += 1
+                    info["hedged"] = True
+                    tasks[asyncio.ensure_future(run(backup))] = backup
+            pending = set(tasks)
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        info.update(host=tasks[task].url, attempts=len(tried) - hedges)
+                        error = task.exception()
+                        if error is None:
+                            return task.result()
+                        if not is_host_failure(error):
+                            raise error
+                        self._failed_over(tasks[task], error)
+                        last_error = error
+            finally:
+                # Cancelling closes the losing stream, which stops generation on that host
+                for task in pending:
+                    task.cancel()
+
+    # --- stats ---
+
+    def hostnames(self) -> List[str]:
+        return [host.url for host in self.hosts]
+
+    def stats(self) -> List[dict]:
+        """Per-host request counts and latency percentiles (ms) over the recent window."""
+        now = time.monotonic()
+        with self._lock:
+            rows = []
+            for host in self.hosts:
+                samples = list(host.latencies)
+                rows.append({
+                    "host": host.url,
+                    "healthy": host.down_until <= now and not host.suspect,
+                    "outstanding": host.outstanding,
+                    "requests": host.requests,
+                    "failures": host.failures,
+                    "hedges": host.hedges,
+                    "p50_ms": round(percentile(samples, 50) * 1000, 1) if samples else None,
+                    "p95_ms": round(percentile(samples, 95) * 1000, 1) if samples else None,
+                })
+            return rows
+
+    def report(self) -> str:
+        lines = ["Ollama hosts:"]
+        for row in self.stats():
+            latency = (f"p50 {row['p50_ms']:.0f} ms, p95 {row['p95_ms']:.0f} ms"
+                       if row['p50_ms'] is not None else "no samples")
+            lines.append(f"  {row['host']}: {row['requests']} requests, {row['failures']} failures, "
+                         f"{row['hedges']} hedges, {latency}{'' if row['healthy'] else ' [down]'}")
+        return "\n".join(lines)
+
+
+_pools: Dict[str, OllamaPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(hosts: str) -> OllamaPool:
+    """Returns the process-wide pool for a host list (see parse_hosts)."""
+    with _pools_lock:
+        if hosts not in _pools:
+            _pools[hosts] = OllamaPool(parse_hosts(hosts))
+        return _pools[hosts]
@@ -0,0 +1,163 @@
+import json
+import os
+import sys
+from typing import Callable, Dict, List, Set
+
+# --- CONFIGURATION ---
+OVERLAY_STATE_VERSION = 1
+# ---------------------
+
+
+def file_key(chunk_id: str) -> str:
+    """The per-file part of a chunk id ("<sha1(path)[:16]>_<i>" -> "<sha1(path)[:16]>")."""
+    return chunk_id.rsplit('_', 1)[0]
+
+
+class OverlayCollection:
+    """Copy-on-write view of a base collection, with the Collection API this repo uses.
+
+    Writes go to the overlay collection only. Every file touched by a write is
+    recorded as shadowed, and the base collection's chunks of shadowed files are
+    hidden from reads: a changed file is served entirely from the overlay, a
+    deleted one not at all. Both collections must use the same backend and
+    embedding model, so their distances are comparable. The shadowed set is kept
+    in a small JSON file next to the overlay.
+    """
+
+    def __init__(self, base, overlay, state_path: str,
+                 embedding_function: Callable[[List[str]], List[List[float]]], base_name: str = ""):
+        self.base = base
+        self.overlay = overlay
+        self.state_path = state_path
+        self.embedding_function = embedding_function
+        self.base_name = base_name
+        self.shadowed: Set[str] = set()
+        self._hidden_in_base = None  # Number of base chunks that reads skip, computed on demand
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Warning: ignoring unreadable overlay state {self.state_path}: {e}", file=sys.stderr)
+            return
+        if state.get("version") == OVERLAY_STATE_VERSION and state.get("base") == self.base_name:
+            self.shadowed = set(state.get("shadowed", []))
+        else:
+            print(f"Overlay state {self.state_path} belongs to another base; starting a fresh overlay.")
+
+    def _save(self) -> None:
+        self._hidden_in_base = None
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": OVERLAY_STATE_VERSION, "base": self.base_name,
+                       "shadowed": sorted(self.shadowed)}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _visible_base_ids(self, ids: List[str]) -> List[str]:
+        return [i for i in ids if file_key(i) not in self.shadowed]
+
+    @staticmethod
+    def _where(where: dict) -> dict:
+        # Only pass the filter along when there is one: plain Chroma rejects where={}
+        return {"where": where} if where else {}
+
+    def hidden_in_base(self) -> int:
+        if self._hidden_in_base is None:
+            base_ids = self.base.get(include=[])['ids']
+            self._hidden_in_base = len(base_ids) - len(self._visible_base_ids(base_ids))
+        return self._hidden_in_base
+
+    # --- Collection API ---
+
+    def count(self) -> int:
+        return self.overlay.count() + self.base.count() - self.hidden_in_base()
+
+    def get(self, ids: List[str] = None, include: List[str] = ('documents', 'metadatas')) -> dict:
+        include = list(include)
+        found = self.overlay.get(ids=ids, include=include) if ids is None or ids else {'ids': []}
+        in_overlay = set(found['ids'])
+        if ids is None:
+            base = self.base.get(include=include)
+        else:
+            wanted = [i for i in self._visible_base_ids(ids) if i not in in_overlay]
+            base = self.base.get(ids=wanted, include=include) if wanted else {'ids': []}
+        keep = [row for row, chunk_id in enumerate(base['ids']) if file_key(chunk_id) not in self.shadowed]
+        result = {'ids': list(found['ids']) + [base['ids'][row] for row in keep]}
+        for key in include:
+            # Chroma returns embeddings as a numpy array, which has no truth value
+            rows = found.get(key)
+            result[key] = list(rows if rows is not None else []) + [base[key][row] for row in keep]
+        return result
+
+    def _write_options(self, persist: bool) -> dict:
+        # Only the numpy store defers writes; Chroma persists every call itself
+        return {} if persist or not hasattr(self.overlay, "save") else {"persist": False}
+
+    def save(self) -> None:
+        """Writes changes made with persist=False to disk."""
+        if hasattr(self.overlay, "save"):
+            self.overlay.save()
+        self._save()
+
+    def upsert(self, documents: List[str], metadatas: List[dict], ids: List[str],
+               embeddings: List[List[float]] = None, persist: bool = True) -> None:
+        if not ids:
+            return
+        if embeddings is None:
+            embeddings = self.embedding_function(list(documents))
+        self.overlay.upsert(documents=documents, metadatas=metadatas, ids=ids, embeddings=embeddings,
+                            **self._write_options(persist))
+        self.shadowed.update(file_key(i) for i in ids)
+        self._hidden_in_base = None
+        if persist:
+            self._save()
+
+    add = upsert
+
+    def delete(self, ids: List[str], persist: bool = True) -> None:
+        if not ids:
+            return
+        self.overlay.delete(ids=list(ids), **self._write_options(persist))
+        self.shadowed.update(file_key(i) for i in ids)
+        self._hidden_in_base = None
+        if persist:
+            self._save()
+
+    def query(self, query_texts: List[str] = None, query_embeddings: List[List[float]] = None,
+              n_results: int = 10,
+              include: List[str] = ('documents', 'metadatas', 'distances'), where: dict = None) -> dict:
+        include = [key for key in include if key != 'distances'] + ['distances']
+        if query_embeddings is None:
+            query_embeddings = self.embedding_function(list(query_texts))
+        query_embeddings = [list(map(float, e)) for e in query_embeddings]
+        result: Dict[str, list] = {key: [] for key in ['ids', *include]}
+        parts = []  # (result, is_base)
+        overlay_count = self.overlay.count()
+        if overlay_count:
+            parts.append((self.overlay.query(query_embeddings=query_embeddings,
+                                             n_results=min(n_results, overlay_count), include=include,
+                                             **self._where(where)), False))
+        base_count = self.base.count()
+        if base_count:
+            # Over-fetch by the number of hidden chunks so filtering never leaves a query short
+            depth = min(n_results + self.hidden_in_base(), base_count)
+            parts.append((self.base.query(query_embeddings=query_embeddings, n_results=depth, include=include,
+                                          **self._where(where)), True))
+
+        for q in range(len(query_embeddings)):
+            rows = []
+            for part, is_base in parts:
+                for row, chunk_id in enumerate(part['ids'][q]):
+                    if not (is_base and file_key(chunk_id) in self.shadowed):
+                        rows.append((part['distances'][q][row], chunk_id, part, row))
+            rows.sort(key=lambda item: (item[0], item[1]))
+            rows = rows[:n_results]
+            result['ids'].append([chunk_id for _, chunk_id, _, _ in rows])
+            for key in include:
+                result[key].append([part[key][q][row] for _, _, part, row in rows])
+        return result
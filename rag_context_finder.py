@@ -1,172 +1,2127 @@
+from __future__ import annotations
+
 import argparse
+import bisect
+import fnmatch
+import hashlib
+import json
 import os
+import re
 import sys
-from pathlib import Path
-from typing import List, Dict
+import threading
+import time
+from array import array
+from collections import deque
+from typing import TYPE_CHECKING, List, Dict, Optional, Set, Tuple
+
+from cpp_chunker import CPP_EXTENSIONS, CodeChunk, chunk_cpp, chunk_fixed
+from lexical_index import CorpusStats, LexicalIndex, merge_corpus_stats, query_terms, reciprocal_rank_fusion
+from llm_metrics import record_call
+from ollama_pool import get_pool
 
 # --- Ollama Imports ---
-import ollama
-import chromadb
-from chromadb.utils import embedding_functions
+# ollama, chromadb (and the HTTP/SQLite modules) are imported where they are first
+# needed, so --help, argument errors and thin-client calls do not pay for them.
+if TYPE_CHECKING:
+    import chromadb
 
 # --- CONFIGURATION (Customize these) ---
 # NOTE: The Ollama server must be running on the Jenkins agent or accessible via this host/port.
 OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://192.168.1.107:11434") 
+OLLAMA_HOSTS = os.environ.get("OLLAMA_HOSTS", OLLAMA_HOST)  # Comma-separated; see ollama_pool.py
 EMBEDDING_MODEL_NAME = "nomic-embed-text"  # Ensure this model is pulled in Ollama (e.g., 'ollama pull nomic-embed-text')
+# Embedder: "ollama" (EMBEDDING_MODEL_NAME on OLLAMA_HOST) or "sentence-transformers" (ST_MODEL_NAME in-process on CPU)
+EMBEDDER = os.environ.get("RAG_EMBEDDER", "ollama")
+ST_MODEL_NAME = os.environ.get("RAG_ST_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+ST_THREADS = int(os.environ.get("RAG_ST_THREADS", str(os.cpu_count() or 1)))  # torch intra-op threads
+# Recorded in manifests, caches and snapshots; indexes built by another model are rebuilt
+EMBEDDING_MODEL_ID = EMBEDDING_MODEL_NAME if EMBEDDER == "ollama" else f"sentence-transformers:{ST_MODEL_NAME}"
 
-DB_PATH = "/tmp/chroma_db_cache"
+DB_PATH = os.environ.get("RAG_DB_PATH", "/tmp/chroma_db_cache")
 COLLECTION_NAME = "code_snippets_ollama"
-SNIPPET_SIZE = 500  # Max chunk size for embedding
+MANIFEST_PATH = os.path.join(DB_PATH, f"{COLLECTION_NAME}_manifest.json")  # Indexed files -> chunk ids
+# Storage backend: "chroma" (PersistentClient) or "numpy" (flat exact search, see numpy_store.py)
+VECTOR_BACKEND = os.environ.get("RAG_BACKEND", "chroma")
+NUMPY_INDEX_PATH = os.path.join(DB_PATH, f"{COLLECTION_NAME}_numpy")
+VECTOR_DTYPE = os.environ.get("RAG_VECTOR_DTYPE", "float32")  # numpy backend: float32, float16 or int8
+# Per-branch indexes: with a repository and branch set, the collection is namespaced by both, and a
+# branch other than the base branch only stores the files that differ from the base collection
+RAG_REPO = os.environ.get("RAG_REPO", "")
+RAG_BRANCH = os.environ.get("RAG_BRANCH", "")
+RAG_BASE_BRANCH = os.environ.get("RAG_BASE_BRANCH", "main")
+MANIFEST_VERSION = 2
+N_RESULTS = 3  # Snippets returned by retrieve mode
+# Hybrid retrieval: BM25 and vector rankings are merged by reciprocal rank fusion
+LEXICAL_WEIGHT = float(os.environ.get("RAG_LEXICAL_WEIGHT", "1.0"))  # 0 disables BM25
+VECTOR_WEIGHT = float(os.environ.get("RAG_VECTOR_WEIGHT", "1.0"))    # 0 disables embedding search
+RRF_K = int(os.environ.get("RAG_RRF_K", "60"))
+CANDIDATE_DEPTH = 20  # Candidates taken from each ranking before fusion
+# Miss-list queries search only non-test code in the directories of the files with uncovered lines
+AUTO_SCOPE = os.environ.get("RAG_AUTO_SCOPE", "1") != "0"
+FILE_KINDS = ("header", "implementation", "test", "other")
+HEADER_EXTENSIONS = ('.h', '.hpp', '.hh', '.hxx')
+# Context packing: snippets are added by relevance until this many (estimated) tokens; 0 = no limit
+TOKEN_BUDGET = int(os.environ.get("RAG_TOKEN_BUDGET", "0"))
+CHARS_PER_TOKEN = 3.5  # Rough average for C++ with Llama-family tokenizers
+MIN_PARTIAL_TOKENS = 64  # Smallest remainder worth filling with a truncated snippet
+SNIPPET_SIZE = 500  # Window size for files the C++ chunker does not handle
+CHUNK_MAX_CHARS = int(os.environ.get("CHUNK_MAX_CHARS", "1500"))  # Functions/classes above this are sub-split
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "64"))  # Texts per /api/embed request
+# Indexing pipeline: worker threads read, hash and chunk files while the main thread embeds and upserts
+INDEX_WORKERS = int(os.environ.get("RAG_INDEX_WORKERS", str(min(8, os.cpu_count() or 1))))
+INDEX_BATCH_SIZE = int(os.environ.get("RAG_INDEX_BATCH_SIZE", "256"))  # Chunks per upsert
+# Sharding: one collection per top-level directory (this many path components); 0 = a single collection
+SHARD_DEPTH = int(os.environ.get("RAG_SHARD_DEPTH", "0"))
+SHARD_QUERY_WORKERS = int(os.environ.get("RAG_SHARD_QUERY_WORKERS", "8"))  # Shards searched concurrently
+CHUNKER_VERSION = f"cpp-v1-{CHUNK_MAX_CHARS}-fixed-{SNIPPET_SIZE}"  # Bump whenever get_code_snippets changes
+
+# Embedding cache lives outside /tmp so it survives a wiped DB_PATH. Set to "" to disable.
+EMBED_CACHE_PATH = os.environ.get(
+    "EMBED_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "rag_context_finder", "embeddings.sqlite"))
+EMBED_CACHE_MAX_ENTRIES = int(os.environ.get("EMBED_CACHE_MAX_ENTRIES", "200000"))
+# Retrieved contexts per (query, k, options, index version); a re-indexed collection invalidates them
+QUERY_CACHE_PATH = os.environ.get(
+    "RAG_QUERY_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "rag_context_finder", "queries.sqlite"))
+QUERY_CACHE_TTL = float(os.environ.get("RAG_QUERY_CACHE_TTL", str(7 * 24 * 3600)))  # Seconds
+QUERY_CACHE_MAX_ENTRIES = int(os.environ.get("RAG_QUERY_CACHE_MAX_ENTRIES", "5000"))
+
+SNAPSHOT_VERSION = 1  # Layout of the archives written by 'export' mode
+SNAPSHOT_BATCH = 1000  # Chunks read from / written to the collection per call during export/import
+
+# Local context server ('serve' mode); other modes forward to it when it is running
+RAG_SERVER_ADDRESS = os.environ.get("RAG_SERVER_ADDRESS", "127.0.0.1:8765")
 # ----------------------------------------
 
 
-def get_ollama_ef():
-    """Initializes and returns the ChromaDB Embedding Function using Ollama."""
+def _normalize(vector: List[float]) -> List[float]:
+    """Scales a vector to unit length (matches the output of Ollama's /api/embed)."""
+    norm = sum(x * x for x in vector) ** 0.5
+    if norm == 0:
+        return list(vector)
+    return [x / norm for x in vector]
+
+
+class EmbeddingCache:
+    """Content-addressed on-disk embedding cache with LRU eviction.
+
+    Keys are SHA-256 digests of (embedding model, chunker version, snippet text),
+    values are float32 vectors. Backed by SQLite so several pipelines on one agent
+    can share it.
+    """
+
+    def __init__(self, path: str, max_entries: int = EMBED_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        import sqlite3
+
+        # Shared by the context server's request threads, hence the lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, embedding BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model_name: str, text: str, chunker_version: str = CHUNKER_VERSION) -> str:
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return hashlib.sha256(f"{model_name}\0{chunker_version}\0{digest}".encode('utf-8')).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Returns cached vectors for the given keys and refreshes their LRU timestamp."""
+        with self._lock:
+            found = self._get_many(keys)
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def _get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        # Stay below SQLite's host-parameter limit
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT key, embedding FROM embeddings WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = array('f', blob).tolist()
+        if found:
+            now = time.time()
+            self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                   [(now, key) for key in found])
+            self._conn.commit()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        """Stores vectors and evicts the least recently used entries above max_entries."""
+        if not items:
+            return
+        with self._lock:
+            self._put_many(items)
+
+    def _put_many(self, items: Dict[str, List[float]]) -> None:
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, embedding, last_used) VALUES (?, ?, ?)",
+            [(key, array('f', vector).tobytes(), now) for key, vector in items.items()]
+        )
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,)
+            )
+        self._conn.commit()
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        rate = (100.0 * self.hits / total) if total else 0.0
+        return f"Embedding cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate) [{self.path}]"
+
+
+_embedding_cache = None
+
+
+def get_embedding_cache():
+    """Returns the process-wide EmbeddingCache, or None if caching is disabled."""
+    import sqlite3
+
+    global _embedding_cache
+    if _embedding_cache is None and EMBED_CACHE_PATH:
+        try:
+            _embedding_cache = EmbeddingCache(EMBED_CACHE_PATH)
+        except sqlite3.Error as e:
+            print(f"Warning: embedding cache disabled ({e}).", file=sys.stderr)
+            return None
+    return _embedding_cache
+
+
+class QueryCache:
+    """Persistent cache of retrieved contexts with TTL and LRU eviction.
+
+    Entries belong to a namespace (one per collection) and an index version; a
+    lookup only matches the current version, and storing a result under a new
+    version drops the namespace's older entries. SQLite, like EmbeddingCache.
+    """
+
+    def __init__(self, path: str, ttl: float = QUERY_CACHE_TTL, max_entries: int = QUERY_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        import sqlite3
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_results ("
+            "key TEXT PRIMARY KEY, namespace TEXT NOT NULL, version TEXT NOT NULL, context TEXT NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_query_last_used ON query_results(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(namespace: str, query: str, n_results: int, options: dict) -> str:
+        # Line-wise whitespace normalization: re-generated miss lists differ only in layout
+        lines = (' '.join(line.split()) for line in query.strip().splitlines())
+        normalized = '\n'.join(line for line in lines if line)
+        payload = json.dumps([namespace, normalized, n_results, options], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get_many(self, keys: List[str], version: str) -> Dict[str, str]:
+        """Returns the unexpired contexts stored for the keys under this index version."""
+        now = time.time()
+        with self._lock:
+            found = {}
+            for key in dict.fromkeys(keys):
+                row = self._conn.execute(
+                    "SELECT context FROM query_results WHERE key = ? AND version = ? AND created > ?",
+                    (key, version, now - self.ttl)
+                ).fetchone()
+                if row:
+                    found[key] = row[0]
+            if found:
+                self._conn.executemany("UPDATE query_results SET last_used = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+                self._conn.commit()
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, namespace: str, version: str, items: Dict[str, str]) -> None:
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM query_results WHERE (namespace = ? AND version != ?) OR created <= ?",
+                               (namespace, version, now - self.ttl))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO query_results (key, namespace, version, context, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(key, namespace, version, context, now, now) for key, context in items.items()]
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM query_results").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM query_results WHERE key IN "
+                    "(SELECT key FROM query_results ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def report(self) -> str:
+        return f"Query cache: {self.hits} hits, {self.misses} misses [{self.path}]"
+
+
+_query_cache = None
+
+
+def get_query_cache():
+    """Returns the process-wide QueryCache, or None if disabled."""
+    import sqlite3
+
+    global _query_cache
+    if _query_cache is None and QUERY_CACHE_PATH and QUERY_CACHE_MAX_ENTRIES > 0:
+        try:
+            _query_cache = QueryCache(QUERY_CACHE_PATH)
+        except sqlite3.Error as e:
+            print(f"Warning: query cache disabled ({e}).", file=sys.stderr)
+            return None
+    return _query_cache
+
+
+def embed_with_cache(cache, model_id: str, texts: List[str], embed) -> List[List[float]]:
+    """Serves texts from the embedding cache and embeds each distinct missing one once.
+
+    Records an "embed_cache" metrics call with the hit and miss counts; its
+    wall time covers the cache reads and writes only, not the embedding.
+    """
+    if cache is None:
+        return embed(texts)
+
+    start = time.perf_counter()
+    keys = [EmbeddingCache.make_key(model_id, text) for text in texts]
+    cached = cache.get_many(keys)
+    hits = sum(1 for key in keys if key in cached)
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in cached and key not in missing:
+            missing[key] = text
+    seconds = time.perf_counter() - start
+    if missing:
+        fresh = dict(zip(missing.keys(), embed(list(missing.values()))))
+        start = time.perf_counter()
+        cache.put_many(fresh)
+        cached.update(fresh)
+        seconds += time.perf_counter() - start
+    record_call("rag_context_finder", "embed_cache", model_id, "\n".join(texts), seconds, cache_hit=not missing,
+                inputs=len(texts), embed_cache_hits=hits, embed_cache_misses=len(texts) - hits)
+    return [cached[key] for key in keys]
+
+
+def select_embedder(embedder: str) -> None:
+    """Switches the process to another embedder (the --embedder option)."""
+    global EMBEDDER, EMBEDDING_MODEL_ID
+    EMBEDDER = embedder
+    EMBEDDING_MODEL_ID = EMBEDDING_MODEL_NAME if embedder == "ollama" else f"sentence-transformers:{ST_MODEL_NAME}"
+
+
+def get_embedding_function(batch_size: int = EMBED_BATCH_SIZE, for_chroma: bool = True):
+    """The configured embedder's embedding function (see get_ollama_ef for for_chroma)."""
+    if EMBEDDER == "sentence-transformers":
+        return get_sentence_transformer_ef(batch_size=batch_size, for_chroma=for_chroma)
+    return get_ollama_ef(batch_size=batch_size, for_chroma=for_chroma)
+
+
+_sentence_transformers = {}
+_sentence_transformers_lock = threading.Lock()
+
+
+def load_sentence_transformer(model_name: str = ST_MODEL_NAME, threads: int = ST_THREADS):
+    """Loads a sentence-transformers model on CPU once per process (the server reuses it)."""
+    with _sentence_transformers_lock:
+        if model_name not in _sentence_transformers:
+            import torch
+            from sentence_transformers import SentenceTransformer
+
+            torch.set_num_threads(max(1, threads))
+            start = time.perf_counter()
+            _sentence_transformers[model_name] = SentenceTransformer(model_name, device="cpu")
+            print(f"Loaded {model_name} on CPU with {threads} threads in {time.perf_counter() - start:.1f}s.",
+                  file=sys.stderr)
+        return _sentence_transformers[model_name]
+
+
+def get_sentence_transformer_ef(batch_size: int = EMBED_BATCH_SIZE, for_chroma: bool = True):
+    """In-process CPU embedding function; needs no Ollama host.
+
+    The model loads on the first call, so cached embeddings and query cache hits
+    never pay for importing torch.
+    """
+    if for_chroma:
+        from chromadb.utils import embedding_functions
+        base = embedding_functions.EmbeddingFunction
+    else:
+        base = object
+
+    class SentenceTransformerEmbeddingFunction(base):
+        def __init__(self, model_name: str, batch_size: int, threads: int):
+            self.model_name = model_name
+            self.batch_size = max(1, batch_size)
+            self.threads = threads
+            self.cache = get_embedding_cache()
+
+        def __call__(self, texts: List[str]) -> List[List[float]]:
+            return embed_with_cache(self.cache, EMBEDDING_MODEL_ID, texts, self._embed_uncached)
+
+        def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
+            model = load_sentence_transformer(self.model_name, self.threads)
+            start = time.perf_counter()
+            # Unit vectors, like Ollama's /api/embed
+            vectors = model.encode(list(texts), batch_size=self.batch_size, normalize_embeddings=True,
+                                   convert_to_numpy=True, show_progress_bar=False)
+            record_call("rag_context_finder", "embed", self.model_name, "\n".join(texts),
+                        time.perf_counter() - start, host="local", inputs=len(texts))
+            return vectors.astype('float32').tolist()
+
+    return SentenceTransformerEmbeddingFunction(model_name=ST_MODEL_NAME, batch_size=batch_size, threads=ST_THREADS)
+
+
+def get_ollama_ef(batch_size: int = EMBED_BATCH_SIZE, for_chroma: bool = True):
+    """Initializes and returns the ChromaDB Embedding Function using Ollama.
+
+    With for_chroma=False the function is a plain callable, so backends other
+    than ChromaDB do not have to import chromadb.
+    """
     # MODIFIED: Use the OllamaEmbeddingFunction provided by ChromaDB or a custom one
     # Note: Requires ollama Python package and the Ollama service to be running.
-    class OllamaEmbeddingFunction(embedding_functions.EmbeddingFunction):
-        def __init__(self, model_name: str, host: str):
+    import ollama
+    if for_chroma:
+        from chromadb.utils import embedding_functions
+        base = embedding_functions.EmbeddingFunction
+    else:
+        base = object
+
+    class OllamaEmbeddingFunction(base):
+        def __init__(self, model_name: str, hosts: str, batch_size: int):
             self.model_name = model_name
-            self.host = host
+            # Clients (and their HTTP connection pools) live in the process-wide host pool
+            self.pool = get_pool(hosts)
+            self.batch_size = max(1, batch_size)
+            # None = not probed yet, False = server/library only has /api/embeddings
+            self._supports_batch = None
+            self.cache = get_embedding_cache()
+
+        def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+            """Embeds a batch with one /api/embed request."""
+            response = self._call(lambda client: client.embed(model=self.model_name, input=batch), batch)
+            embeddings = response['embeddings']
+            if len(embeddings) != len(batch):
+                raise ValueError(f"Ollama returned {len(embeddings)} embeddings for {len(batch)} inputs")
+            return [list(e) for e in embeddings]
+
+        def _embed_single(self, batch: List[str]) -> List[List[float]]:
+            """Legacy path: one /api/embeddings request per text."""
+            embeddings = []
+            for text in batch:
+                response = self._call(lambda client: client.embeddings(model=self.model_name, prompt=text), [text])
+                # /api/embed returns unit vectors; keep both paths comparable
+                embeddings.append(_normalize(response['embedding']))
+            return embeddings
+
+        def _call(self, fn, texts: List[str]):
+            """pool.call that records the request (see llm_metrics.py); the legacy endpoint reports no counts."""
+            info = {}
+            start = time.perf_counter()
+            try:
+                response = self.pool.call(fn, info)
+            except Exception as e:
+                record_call("rag_context_finder", "embed", self.model_name, "\n".join(texts),
+                            time.perf_counter() - start, host=info.get("host", ""),
+                            retries=max(info.get("attempts", 1) - 1, 0), hedged=info.get("hedged", False),
+                            error=str(e) or type(e).__name__, inputs=len(texts))
+                raise
+            record_call("rag_context_finder", "embed", self.model_name, "\n".join(texts),
+                        time.perf_counter() - start, response, host=info.get("host", ""),
+                        retries=max(info.get("attempts", 1) - 1, 0), hedged=info.get("hedged", False),
+                        inputs=len(texts))
+            return response
+
+        def _batch_unsupported(self, error: Exception) -> bool:
+            """True if the error means the server has no multi-input embed endpoint."""
+            if isinstance(error, AttributeError):
+                # ollama Python package older than 0.3 has no Client.embed
+                return True
+            return isinstance(error, ollama.ResponseError) and getattr(error, 'status_code', None) == 404
 
         def __call__(self, texts: List[str]) -> List[List[float]]:
-            # Connect to Ollama client 
-            client = ollama.Client(host=self.host)
-            
-            # Generate embeddings for the list of texts
+            return embed_with_cache(self.cache, self.model_name, texts, self._embed_uncached)
+
+        def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
             embeddings = []
-            for text in texts:
-                response = client.embeddings(model=self.model_name, prompt=text)
-                embeddings.append(response['embedding'])
+            for start in range(0, len(texts), self.batch_size):
+                batch = list(texts[start:start + self.batch_size])
+                if self._supports_batch is not False:
+                    try:
+                        embeddings.extend(self._embed_batch(batch))
+                        self._supports_batch = True
+                        continue
+                    except Exception as e:
+                        if self._supports_batch or not self._batch_unsupported(e):
+                            raise
+                        print("Ollama batch embed endpoint unavailable; falling back to per-text requests.",
+                              file=sys.stderr)
+                        self._supports_batch = False
+                embeddings.extend(self._embed_single(batch))
             return embeddings
 
     # Initialize the custom Ollama Embedding Function
     return OllamaEmbeddingFunction(
         model_name=EMBEDDING_MODEL_NAME, 
-        host=OLLAMA_HOST
+        hosts=OLLAMA_HOSTS,
+        batch_size=batch_size
     )
 
 
-def get_db_client():
-    """Initializes ChromaDB client and collection with Ollama embeddings."""
+def collection_name(repo: str = RAG_REPO, branch: str = RAG_BRANCH) -> str:
+    """COLLECTION_NAME, namespaced by repository and branch when they are given."""
+    parts = [COLLECTION_NAME] + [re.sub(r'[^A-Za-z0-9_-]+', '-', p).strip('-') for p in (repo, branch) if p]
+    return '--'.join(parts)
+
+
+def get_numpy_index_path(collection: str = COLLECTION_NAME, dtype: str = VECTOR_DTYPE) -> str:
+    """Each vector dtype gets its own directory, so indexes of different dtypes do not replace each other.
+
+    float32 keeps the unsuffixed name of indexes built before dtypes existed.
+    """
+    path = NUMPY_INDEX_PATH if collection == COLLECTION_NAME else os.path.join(DB_PATH, f"{collection}_numpy")
+    return path if dtype == "float32" else f"{path}_{dtype}"
+
+
+def get_manifest_path(backend: str = VECTOR_BACKEND, collection: str = COLLECTION_NAME,
+                      dtype: str = VECTOR_DTYPE) -> str:
+    """Each backend keeps its own manifest; the numpy one lives inside its index directory."""
+    if backend == "numpy":
+        return os.path.join(get_numpy_index_path(collection, dtype), "manifest.json")
+    if collection == COLLECTION_NAME:
+        return MANIFEST_PATH
+    return os.path.join(DB_PATH, f"{collection}_manifest.json")
+
+
+def get_db_client(embed_batch_size: int = EMBED_BATCH_SIZE, backend: str = VECTOR_BACKEND,
+                  vector_dtype: str = VECTOR_DTYPE, collection: str = COLLECTION_NAME):
+    """Initializes the vector store collection (ChromaDB or numpy) with Ollama embeddings."""
     try:
-        # Initialize the custom Ollama Embedding Function
-        ollama_ef = get_ollama_ef()
+        if backend == "numpy":
+            from numpy_store import NumpyCollection
+
+            embedding_fn = get_embedding_function(batch_size=embed_batch_size, for_chroma=False)
+            return NumpyCollection(get_numpy_index_path(collection, vector_dtype), embedding_fn,
+                                   embedding_model=EMBEDDING_MODEL_ID, dtype=vector_dtype)
+        if vector_dtype != "float32":
+            print(f"Warning: ChromaDB always stores float32; ignoring vector dtype {vector_dtype}.", file=sys.stderr)
+
+        import chromadb
+
+        # Initialize the configured (Ollama or sentence-transformers) Embedding Function
+        embedding_fn = get_embedding_function(batch_size=embed_batch_size)
         
         # Initialize PersistentClient
         persistent_client = chromadb.PersistentClient(path=DB_PATH)
         
-        # Get or create the collection, setting the Ollama embedding function
+        # Get or create the collection, setting the embedding function
+        name = collection
         collection = persistent_client.get_or_create_collection(
-            name=COLLECTION_NAME,
-            embedding_function=ollama_ef
+            name=name,
+            embedding_function=embedding_fn
         )
+        recorded = (collection.metadata or {}).get("embedding_model")
+        if recorded is None and collection.count():
+            # Collections from before this field was recorded were built with Ollama
+            recorded = EMBEDDING_MODEL_NAME
+        if recorded is None:
+            collection.modify(metadata={**(collection.metadata or {}), "embedding_model": EMBEDDING_MODEL_ID})
+        elif recorded != EMBEDDING_MODEL_ID:
+            # ChromaDB fixes the vector dimension at the first insert, so start a new collection
+            print(f"Collection {name} was built with {recorded}; recreating it for {EMBEDDING_MODEL_ID}.")
+            persistent_client.delete_collection(name)
+            collection = persistent_client.create_collection(
+                name=name,
+                embedding_function=embedding_fn,
+                metadata={"embedding_model": EMBEDDING_MODEL_ID}
+            )
         return collection
         
     except Exception as e:
-        print(f"Error initializing ChromaDB or Ollama Embedding Function: {e}", file=sys.stderr)
-        # Detailed error if Ollama service is down
-        print(f"Ensure Ollama is running and model '{EMBEDDING_MODEL_NAME}' is pulled.", file=sys.stderr)
+        print(f"Error initializing the {backend} vector store or {EMBEDDER} Embedding Function: {e}", file=sys.stderr)
+        if EMBEDDER == "ollama":
+            # Detailed error if Ollama service is down
+            print(f"Ensure Ollama is running and model '{EMBEDDING_MODEL_NAME}' is pulled.", file=sys.stderr)
         sys.exit(1)
 
 
-def get_code_snippets(file_path: str):
-    """Simple function chunker."""
+def get_code_snippets(file_path: str, max_chars: int = CHUNK_MAX_CHARS):
+    """Yields CodeChunks: structural for C/C++ sources, fixed windows otherwise."""
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             content = f.read()
-            # Simple chunking by SNIPPET_SIZE for demonstration.
-            for i in range(0, len(content), SNIPPET_SIZE):
-                yield content[i:i + SNIPPET_SIZE]
     except FileNotFoundError:
         print(f"Warning: File not found at {file_path}", file=sys.stderr)
         return
 
+    yield from chunk_source(file_path, content, max_chars)
+
+
+def chunk_source(file_path: str, content: str, max_chars: int = CHUNK_MAX_CHARS) -> List[CodeChunk]:
+    if file_path.lower().endswith(CPP_EXTENSIONS):
+        return chunk_cpp(content, max_chars)
+    return chunk_fixed(content, SNIPPET_SIZE)
+
+
+def chunk_metadata(file_path: str, chunk: CodeChunk) -> dict:
+    return {
+        "source": file_path,
+        "start_line": chunk.start_line,
+        "end_line": chunk.end_line,
+        "kind": chunk.kind,
+        "symbol": chunk.symbol,
+    }
+
+
+def load_manifest(manifest_path: str) -> Dict[str, dict]:
+    """Loads the index manifest ({path: {size, mtime, sha256, chunk_ids, chunk_lines}}), or None if absent."""
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Warning: ignoring unreadable manifest {manifest_path}: {e}", file=sys.stderr)
+        return None
+    if (data.get("manifest_version") != MANIFEST_VERSION or data.get("chunker_version") != CHUNKER_VERSION
+            or data.get("embedding_model") != EMBEDDING_MODEL_ID):
+        print("Manifest was built with a different chunker or embedding model; re-indexing all files.")
+        return None
+    return data.get("files", {})
+
+
+def save_manifest(manifest_path: str, files: Dict[str, dict], dimension: int = 0) -> None:
+    """Writes the manifest atomically so a crashed run never leaves it half-written.
+
+    dimension is the length of the stored embeddings (0 if unknown or empty).
+    """
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    data = {
+        "manifest_version": MANIFEST_VERSION,
+        "chunker_version": CHUNKER_VERSION,
+        "embedding_model": EMBEDDING_MODEL_ID,
+        "embedding_dimension": dimension,
+        "files": files,
+    }
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+    # Content version for the query cache: ignores size/mtime refreshes of unmodified files
+    contents = {path: [entry["sha256"], entry["chunk_ids"]] for path, entry in files.items()}
+    version = hashlib.sha256(json.dumps([CHUNKER_VERSION, EMBEDDING_MODEL_ID, contents],
+                                        sort_keys=True).encode('utf-8')).hexdigest()
+    version_path = index_version_path(manifest_path)
+    if read_index_version(manifest_path) != version:
+        with open(f"{version_path}.tmp", 'w', encoding='utf-8') as f:
+            f.write(version)
+        os.replace(f"{version_path}.tmp", version_path)
+
+
+def index_version_path(manifest_path: str) -> str:
+    return os.path.splitext(manifest_path)[0] + "_version"
+
+
+def read_index_version(manifest_path: str) -> str:
+    """Digest of the indexed contents written by save_manifest, "" if there is none."""
+    try:
+        with open(index_version_path(manifest_path), 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def manifest_dimension(manifest_path: str) -> int:
+    """Embedding dimension recorded in a manifest, 0 if none."""
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return int(json.load(f).get("embedding_dimension") or 0)
+    except (OSError, ValueError):
+        return 0
 
-def index_codebase(client: chromadb.Collection, context_files: List[str]):
-    """Indexes the files into the ChromaDB collection."""
+
+def stored_dimension(client: chromadb.Collection, manifest: Dict[str, dict]) -> int:
+    """Length of one stored embedding, read back from the collection (0 if it is empty)."""
+    for entry in manifest.values():
+        if entry["chunk_ids"]:
+            found = client.get(ids=entry["chunk_ids"][:1], include=['embeddings'])
+            embeddings = found.get('embeddings')
+            return len(embeddings[0]) if embeddings is not None and len(embeddings) else 0
+    return 0
+
+
+def scan_file(disk_path: str, entry: dict = None) -> Tuple[str, dict, List[CodeChunk]]:
+    """Index worker: stats, hashes and chunks one file against its manifest entry.
+
+    Returns ("missing", None, []), ("unchanged", entry, []) or ("changed", entry
+    without chunk fields, chunks). The file is read once for hashing and chunking.
+    """
+    try:
+        stat = os.stat(disk_path)
+    except OSError:
+        return "missing", None, []
+    if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+        return "unchanged", entry, []
+
+    try:
+        with open(disk_path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return "missing", None, []
+    content_hash = hashlib.sha256(data).hexdigest()
+    if entry and entry["sha256"] == content_hash:
+        # Touched but not modified: just refresh the stat fields
+        return "unchanged", dict(entry, size=stat.st_size, mtime=stat.st_mtime), []
+
+    # Same newline translation as reading in text mode
+    content = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+    new_entry = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": content_hash}
+    return "changed", new_entry, chunk_source(disk_path, content)
+
+
+def chunk_id(file_path: str, index: int) -> str:
+    """Stable chunk id so re-indexing a file overwrites its previous chunks."""
+    path_digest = hashlib.sha1(file_path.encode('utf-8')).hexdigest()[:16]
+    return f"{path_digest}_{index}"
+
+
+def index_codebase(client: chromadb.Collection, context_files: List[str], manifest_path: str = MANIFEST_PATH,
+                   root: str = None) -> dict:
+    """Incrementally indexes the files into the ChromaDB collection.
+
+    The manifest records size, mtime, content hash and chunk ids per file, so only
+    changed files are re-chunked and upserted, and chunks of files that are no
+    longer part of the file list are deleted. Relative paths are opened under
+    root (default: the working directory) but recorded as given.
+    """
     print(f"Indexing {len(context_files)} files...")
-    
-    # We only index if the collection is empty
-    if client.count() > 0:
-        print("Database already contains data. Skipping indexing.")
-        return
 
-    documents = []
-    metadatas = []
-    ids = []
-    doc_id_counter = 0
+    manifest = load_manifest(manifest_path)
+    lexical = LexicalIndex.load(lexical_index_path(manifest_path))
+    if manifest is not None and sum(len(e["chunk_ids"]) for e in manifest.values()) != client.count():
+        # Collection was dropped or modified behind the manifest's back
+        print("Manifest does not match the collection contents; re-indexing all files.")
+        manifest = None
+    if manifest is None:
+        manifest = {}
+        lexical = LexicalIndex(lexical.path)
+        if client.count() > 0:
+            # Collection predates the manifest (or was built differently): start over
+            print("No usable manifest for the existing collection. Rebuilding index.")
+            stale_ids = client.get(include=[])['ids']
+            if stale_ids:
+                client.delete(ids=stale_ids)
 
-    for file_path in context_files:
-        for snippet in get_code_snippets(file_path):
-            documents.append(snippet)
-            metadatas.append({"source": file_path})
-            ids.append(f"doc_{doc_id_counter}")
-            doc_id_counter += 1
+    new_manifest = {}
+    stale_ids = []
+    changed = unchanged = upserted = 0
+    batch = {"documents": [], "metadatas": [], "ids": []}
+    deferred = deferred_writes(client)
 
-    if documents:
+    def flush() -> None:
+        nonlocal upserted
+        if not batch["ids"]:
+            return
         # Client handles embedding generation using the configured Ollama EF
-        client.add(
-            documents=documents,
-            metadatas=metadatas,
-            ids=ids
+        client.upsert(**batch, **deferred)
+        for chunk, doc in zip(batch["ids"], batch["documents"]):
+            lexical.add(chunk, doc)
+        upserted += len(batch["ids"])
+        for values in batch.values():
+            values.clear()
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    paths = list(dict.fromkeys(os.path.normpath(f) for f in context_files))
+    with ThreadPoolExecutor(max_workers=max(1, INDEX_WORKERS)) as pool:
+        # Bounded window of scans in flight: workers stay ahead of the embedding calls
+        # without the whole corpus ever being held in memory
+        pending = deque()
+        scans = iter(paths)
+        while True:
+            for file_path in scans:
+                disk_path = os.path.join(root, file_path) if root else file_path
+                pending.append((file_path, pool.submit(scan_file, disk_path, manifest.get(file_path))))
+                if len(pending) >= 4 * max(1, INDEX_WORKERS):
+                    break
+            if not pending:
+                break
+            file_path, future = pending.popleft()
+            status, new_entry, chunks = future.result()
+            if status == "missing":
+                print(f"Warning: File not found at {file_path}", file=sys.stderr)
+                continue
+            new_manifest[file_path] = new_entry
+            if status == "unchanged":
+                unchanged += 1
+                continue
+
+            file_ids = [chunk_id(file_path, i) for i in range(len(chunks))]
+            new_entry["chunk_ids"] = file_ids
+            new_entry["chunk_lines"] = [[chunk.start_line, chunk.end_line] for chunk in chunks]
+            entry = manifest.get(file_path)
+            if entry:
+                stale_ids.extend(set(entry["chunk_ids"]) - set(file_ids))
+            for chunk, chunk_key in zip(chunks, file_ids):
+                batch["documents"].append(chunk.text)
+                batch["metadatas"].append(chunk_metadata(file_path, chunk))
+                batch["ids"].append(chunk_key)
+                if len(batch["ids"]) >= INDEX_BATCH_SIZE:
+                    flush()
+            changed += 1
+    flush()
+
+    removed = [path for path in manifest if path not in new_manifest]
+    for path in removed:
+        stale_ids.extend(manifest[path]["chunk_ids"])
+
+    if stale_ids:
+        client.delete(ids=stale_ids, **deferred)
+        lexical.remove(stale_ids)
+    if deferred:
+        client.save()
+    save_manifest(manifest_path, new_manifest, stored_dimension(client, new_manifest))
+    update_lexical_index(client, lexical, new_manifest, dirty=bool(stale_ids or upserted))
+
+    stats = {
+        "changed": changed,
+        "unchanged": unchanged,
+        "removed": len(removed),
+        "upserted": upserted,
+        "deleted": len(stale_ids),
+        "total": client.count(),
+    }
+    print(f"Files: {changed} changed, {unchanged} unchanged, {len(removed)} removed "
+          f"({upserted} snippets upserted, {len(stale_ids)} deleted).")
+    print(f"Indexed {stats['total']} total snippets.")
+
+    cache = get_embedding_cache()
+    if cache is not None:
+        print(cache.report())
+    pool = get_pool(OLLAMA_HOSTS)
+    if EMBEDDER == "ollama" and len(pool.hosts) > 1:
+        print(pool.report())
+    return stats
+
+
+def deferred_writes(client: chromadb.Collection) -> dict:
+    """Write options that postpone persisting to one client.save() call, for stores that support it.
+
+    The numpy store rewrites its files on every write, so bulk loads defer them;
+    ChromaDB persists each call itself and gets no extra options.
+    """
+    return {"persist": False} if hasattr(client, "save") else {}
+
+
+def lexical_index_path(manifest_path: str) -> str:
+    return os.path.splitext(manifest_path)[0] + "_lexical.json"
+
+
+def file_state(path: str) -> Optional[Tuple[int, int, int]]:
+    """(inode, size, mtime_ns) of a file, None if it is absent; atomic replaces change the inode."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+_lexical_indexes: Dict[str, Tuple[Optional[tuple], LexicalIndex]] = {}
+_lexical_lock = threading.Lock()
+
+
+def load_lexical_index(manifest_path: str) -> LexicalIndex:
+    """Returns the BM25 index of a manifest, kept in memory until its file changes.
+
+    The returned index is shared between threads and must only be searched.
+    """
+    path = lexical_index_path(manifest_path)
+    state = file_state(path)
+    with _lexical_lock:
+        cached = _lexical_indexes.get(path)
+        if cached is not None and cached[0] == state:
+            return cached[1]
+    lexical = LexicalIndex.load(path)
+    with _lexical_lock:
+        _lexical_indexes[path] = (state, lexical)
+    return lexical
+
+
+def remember_lexical_index(lexical: LexicalIndex) -> None:
+    """Keeps a just-saved index in memory so the next search does not re-read it."""
+    with _lexical_lock:
+        _lexical_indexes[lexical.path] = (file_state(lexical.path), lexical)
+
+
+def sync_branch_manifest(manifest_path: str, base_manifest_path: str, shadowed: set) -> None:
+    """Makes a branch manifest inherit every base file the branch overlay does not shadow.
+
+    Entries of shadowed files (changed or removed on the branch) are the branch's
+    own; all others mirror the current base manifest, so a base that moved on
+    since the branch was seeded is picked up without re-embedding. When inherited
+    entries change, the branch's BM25 index is dropped and rebuilt from the
+    stored documents on the next index run.
+    """
+    from overlay_collection import file_key
+
+    base = load_manifest(base_manifest_path) or {}
+    branch = load_manifest(manifest_path)
+    if branch is None:
+        branch = {}
+    synced = {path: entry for path, entry in branch.items() if file_key(chunk_id(path, 0)) in shadowed}
+    content_changed = False
+    for path, entry in base.items():
+        if file_key(chunk_id(path, 0)) in shadowed:
+            continue
+        own = branch.get(path)
+        if own and own["sha256"] == entry["sha256"] and own["chunk_ids"] == entry["chunk_ids"]:
+            synced[path] = own  # Keeps this workspace's size/mtime, so the file is not re-hashed
+        else:
+            synced[path] = entry
+            content_changed = True
+    content_changed = content_changed or set(branch) - set(synced)
+    if synced == branch and os.path.exists(manifest_path):
+        return
+    save_manifest(manifest_path, synced, manifest_dimension(base_manifest_path))
+    if content_changed:
+        try:
+            os.remove(lexical_index_path(manifest_path))
+        except FileNotFoundError:
+            pass
+
+
+def update_lexical_index(client: chromadb.Collection, lexical: LexicalIndex, manifest: Dict[str, dict],
+                         dirty: bool) -> None:
+    """Saves the BM25 index that index_codebase updated in place (dirty) or repairs it.
+
+    An index that does not cover exactly the manifest's chunks (first hybrid run
+    on an existing collection, crash between saves) is rebuilt from the stored
+    documents, which needs no embedding calls.
+    """
+    expected = {c for entry in manifest.values() for c in entry["chunk_ids"]}
+    if not dirty and set(lexical.doc_terms) == expected:
+        return
+    if set(lexical.doc_terms) != expected:
+        print("Rebuilding lexical index from stored documents.")
+        lexical = LexicalIndex(lexical.path)
+        stored = client.get(ids=sorted(expected), include=['documents']) if expected else {'ids': []}
+        for chunk, doc in zip(stored['ids'], stored.get('documents') or []):
+            lexical.add(chunk, doc)
+    lexical.save()
+    remember_lexical_index(lexical)
+
+
+def export_index(client: chromadb.Collection, manifest_path: str, archive_path: str) -> int:
+    """Writes the indexed chunks, their vectors and the manifest to a versioned .tar.gz snapshot.
+
+    The archive holds snapshot.json (versions, model, dimension), manifest.json
+    and chunks.jsonl with one {id, document, metadata, embedding} object per
+    chunk; embeddings are base64 little-endian float32. Returns the chunk count.
+    """
+    import base64
+    import io
+    import tarfile
+
+    manifest = load_manifest(manifest_path)
+    if manifest is None:
+        raise RuntimeError(f"No usable manifest at {manifest_path}; run index mode first.")
+    chunk_ids = [c for entry in manifest.values() for c in entry["chunk_ids"]]
+
+    chunks = io.BytesIO()
+    dimension = 0
+    for start in range(0, len(chunk_ids), SNAPSHOT_BATCH):
+        found = client.get(ids=chunk_ids[start:start + SNAPSHOT_BATCH],
+                           include=['documents', 'metadatas', 'embeddings'])
+        for chunk, doc, meta, embedding in zip(found['ids'], found['documents'], found['metadatas'],
+                                               found['embeddings']):
+            vector = array('f', (float(x) for x in embedding))
+            if sys.byteorder != 'little':
+                vector.byteswap()
+            dimension = len(vector)
+            record = {"id": chunk, "document": doc, "metadata": meta,
+                      "embedding": base64.b64encode(vector.tobytes()).decode('ascii')}
+            chunks.write(json.dumps(record).encode('utf-8') + b"\n")
+    exported = chunks.getvalue().count(b"\n")
+    if exported != len(chunk_ids):
+        raise RuntimeError(f"Collection holds {exported} of the manifest's {len(chunk_ids)} chunks; "
+                           f"re-run index mode before exporting.")
+
+    header = {
+        "snapshot_version": SNAPSHOT_VERSION,
+        "manifest_version": MANIFEST_VERSION,
+        "chunker_version": CHUNKER_VERSION,
+        "embedding_model": EMBEDDING_MODEL_ID,
+        "dimension": dimension,
+        "count": exported,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    members = [
+        ("snapshot.json", json.dumps(header, indent=1).encode('utf-8')),
+        ("manifest.json", json.dumps(manifest).encode('utf-8')),
+        ("chunks.jsonl", chunks.getvalue()),
+    ]
+    os.makedirs(os.path.dirname(os.path.abspath(archive_path)), exist_ok=True)
+    tmp_path = f"{archive_path}.tmp"
+    with tarfile.open(tmp_path, 'w:gz') as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+    os.replace(tmp_path, archive_path)
+    print(f"Exported {exported} snippets ({dimension}-dim {EMBEDDING_MODEL_ID}) to {archive_path}.")
+    return exported
+
+
+def import_index(client: chromadb.Collection, manifest_path: str, archive_path: str) -> int:
+    """Replaces the collection with a snapshot written by export_index, without embedding calls.
+
+    The snapshot must match this script's snapshot layout, manifest and chunker
+    versions and embedding model. Imported manifests keep the exporter's mtimes,
+    so the next index run hashes each file once and only re-embeds real changes.
+    """
+    import base64
+    import tarfile
+
+    try:
+        with tarfile.open(archive_path, 'r:gz') as tar:
+            header = json.load(tar.extractfile("snapshot.json"))
+            expected = {"snapshot_version": SNAPSHOT_VERSION, "manifest_version": MANIFEST_VERSION,
+                        "chunker_version": CHUNKER_VERSION, "embedding_model": EMBEDDING_MODEL_ID}
+            mismatched = [f"{key} {header.get(key)!r} (expected {value!r})"
+                          for key, value in expected.items() if header.get(key) != value]
+            if mismatched:
+                raise RuntimeError(f"Snapshot {archive_path} is incompatible: {', '.join(mismatched)}")
+            manifest = json.load(tar.extractfile("manifest.json"))
+            lines = tar.extractfile("chunks.jsonl").read().splitlines()
+    except (OSError, KeyError, ValueError, tarfile.TarError) as e:
+        raise RuntimeError(f"Cannot read snapshot {archive_path}: {e}") from e
+
+    old_ids = client.get(include=[])['ids']
+    deferred = deferred_writes(client)
+    if old_ids:
+        client.delete(ids=old_ids, **deferred)
+    lexical = LexicalIndex(lexical_index_path(manifest_path))
+    for start in range(0, len(lines), SNAPSHOT_BATCH):
+        records = [json.loads(line) for line in lines[start:start + SNAPSHOT_BATCH]]
+        embeddings = []
+        for record in records:
+            vector = array('f')
+            vector.frombytes(base64.b64decode(record["embedding"]))
+            if sys.byteorder != 'little':
+                vector.byteswap()
+            embeddings.append(vector.tolist())
+            lexical.add(record["id"], record["document"])
+        client.upsert(ids=[r["id"] for r in records], documents=[r["document"] for r in records],
+                      metadatas=[r["metadata"] for r in records], embeddings=embeddings, **deferred)
+    if deferred:
+        client.save()
+    lexical.save()
+    save_manifest(manifest_path, manifest, int(header.get("dimension") or 0))
+    print(f"Imported {len(lines)} snippets from {archive_path} (created {header.get('created', 'unknown')}).")
+    return len(lines)
+
+
+MISS_LINE_RE = re.compile(r'File:\s*(\S+)\s+Line:\s*(\d+)')
+
+
+def parse_miss_list(query: str) -> List[Tuple[str, int]]:
+    """Extracts (file, line) pairs from an LCOV miss list ("File: X Line: N (Uncovered)")."""
+    return [(path, int(line)) for path, line in MISS_LINE_RE.findall(query)]
+
+
+class ChunkLineIndex:
+    """Interval index from (file, line) to the id of the chunk containing that line."""
+
+    def __init__(self, manifest: Dict[str, dict]):
+        self._files = {}
+        self._by_name: Dict[str, List[str]] = {}  # Basename -> indexed paths, for suffix matching
+        for path, entry in manifest.items():
+            spans = sorted(zip(entry.get("chunk_lines", []), entry["chunk_ids"]))
+            path = os.path.normpath(path)
+            self._files[path] = (
+                [start for (start, _), _ in spans],
+                [end for (_, end), _ in spans],
+                [chunk for _, chunk in spans],
+            )
+            self._by_name.setdefault(os.path.basename(path), []).append(path)
+
+    def _match_path(self, path: str):
+        """Finds the indexed file for a path; LCOV paths are usually absolute, index paths relative."""
+        path = os.path.normpath(path)
+        if path in self._files:
+            return self._files[path]
+        best = None
+        for indexed in self._by_name.get(os.path.basename(path), ()):
+            if path.endswith(os.sep + indexed) and (best is None or len(indexed) > len(best)):
+                best = indexed
+        return self._files.get(best)
+
+    def lookup(self, path: str, line: int):
+        spans = self._match_path(path)
+        if spans is None:
+            return None
+        starts, ends, ids = spans
+        # Chunks of one file do not overlap, so only the last one starting at or before the line can match
+        pos = bisect.bisect_right(starts, line) - 1
+        if pos >= 0 and ends[pos] >= line:
+            return ids[pos]
+        return None
+
+    def resolve(self, misses: List[Tuple[str, int]]) -> Dict[str, List[int]]:
+        """Maps chunk id -> uncovered lines, ordered by how many lines each chunk covers."""
+        hits: Dict[str, List[int]] = {}
+        for path, line in misses:
+            chunk = self.lookup(path, line)
+            if chunk is not None:
+                hits.setdefault(chunk, []).append(line)
+        return dict(sorted(hits.items(), key=lambda item: -len(item[1])))
+
+
+_manifest_indexes: Dict[str, Tuple[Optional[tuple], Dict[str, dict], ChunkLineIndex]] = {}
+_manifest_lock = threading.Lock()
+
+
+def load_manifest_index(manifest_path: str) -> Tuple[Dict[str, dict], ChunkLineIndex]:
+    """Returns a manifest ({} if unusable) and its ChunkLineIndex, kept in memory until the file changes.
+
+    Both are shared between threads and must not be modified.
+    """
+    state = file_state(manifest_path)
+    with _manifest_lock:
+        cached = _manifest_indexes.get(manifest_path)
+        if cached is not None and cached[0] == state:
+            return cached[1], cached[2]
+    manifest = load_manifest(manifest_path) or {}
+    line_index = ChunkLineIndex(manifest)
+    with _manifest_lock:
+        _manifest_indexes[manifest_path] = (state, manifest, line_index)
+    return manifest, line_index
+
+
+TEST_PATH_RE = re.compile(r'(^|/)(tests?|unittests?)/|(^|/)test_[^/]*$|_(unit)?tests?\.[^/.]+$')
+
+
+def file_kind(path: str) -> str:
+    """Classifies an indexed file as header, implementation, test or other by its path."""
+    path = path.replace(os.sep, '/').lower()
+    if TEST_PATH_RE.search(path):
+        return "test"
+    if path.endswith(HEADER_EXTENSIONS):
+        return "header"
+    if path.endswith(CPP_EXTENSIONS):
+        return "implementation"
+    return "other"
+
+
+def symbol_matches(symbol: str, wanted: str) -> bool:
+    """True if wanted names the chunk's symbol, an enclosing scope of it, or a qualified tail of it."""
+    qualified = "::" + symbol.replace('.', '::') + "::"
+    return f"::{wanted.strip(':')}::" in qualified
+
+
+def scope_from_misses(direct: List[dict]) -> dict:
+    """Search filters for a miss-list query: non-test code next to the chunks with uncovered lines."""
+    scope = {"kinds": ["header", "implementation"]}
+    dirs = sorted({os.path.dirname(c['metadata']['source']) for c in direct})
+    if all(dirs):
+        scope["paths"] = [os.path.join(d, '*') for d in dirs]
+    return scope
+
+
+def resolve_filters(client: chromadb.Collection, manifest: Dict[str, dict],
+                    filters: dict) -> Tuple[Optional[dict], Optional[Set[str]]]:
+    """Turns search filters into a where clause and the chunk ids it admits in one store.
+
+    Path globs and file kinds are matched against the manifest, so they need no
+    collection read; symbols are matched on the metadata of the chunks left after
+    that. Returns (None, None) when the filters admit every chunk.
+    """
+    paths = [path for path in manifest
+             if (not filters.get("paths") or any(fnmatch.fnmatchcase(path, glob) for glob in filters["paths"]))
+             and (not filters.get("kinds") or file_kind(path) in filters["kinds"])]
+    allowed = {chunk for path in paths for chunk in manifest[path]["chunk_ids"]}
+    clauses = []
+    if len(paths) < len(manifest):
+        clauses.append({"source": {"$in": paths}})
+    if filters.get("symbols") and allowed:
+        found = client.get(ids=sorted(allowed), include=['metadatas'])
+        symbols = {}
+        for chunk, metadata in zip(found['ids'], found['metadatas']):
+            symbol = metadata.get("symbol") or ""
+            if symbol and any(symbol_matches(symbol, wanted) for wanted in filters["symbols"]):
+                symbols.setdefault(symbol, set()).add(chunk)
+        allowed = set().union(*symbols.values())
+        clauses.append({"symbol": {"$in": sorted(symbols)}})
+    if not clauses:
+        return None, None
+    return (clauses[0] if len(clauses) == 1 else {"$and": clauses}), allowed
+
+
+def format_snippet(doc: str, metadata: dict, uncovered: List[int] = None, truncated: bool = False) -> str:
+    location = metadata.get('source', 'Unknown')
+    if metadata.get('start_line'):
+        location += f" (lines {metadata['start_line']}-{metadata['end_line']})"
+    if uncovered:
+        location += f" [uncovered: {', '.join(str(line) for line in sorted(uncovered))}]"
+    if truncated:
+        location += " [truncated]"
+    return f"## Source: {location}\n{doc}\n"
+
+
+SNIPPET_SEPARATOR = "\n---\n"
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, int(len(text) / CHARS_PER_TOKEN + 0.999))
+
+
+def _describe(candidate: dict) -> str:
+    metadata = candidate['metadata']
+    if metadata.get('start_line'):
+        return f"{metadata.get('source', 'Unknown')}:{metadata['start_line']}-{metadata['end_line']}"
+    return metadata.get('source', candidate['id'])
+
+
+def _overlaps(candidate: dict, kept: List[dict]) -> bool:
+    metadata = candidate['metadata']
+    if not metadata.get('start_line'):
+        return False
+    for other in kept:
+        other_meta = other['metadata']
+        if (other_meta.get('source') == metadata.get('source') and other_meta.get('start_line')
+                and other_meta['start_line'] <= metadata['end_line']
+                and metadata['start_line'] <= other_meta['end_line']):
+            return True
+    return False
+
+
+def pack_snippets(candidates: List[dict], n_results: int, token_budget: int = TOKEN_BUDGET) -> Tuple[str, List[str]]:
+    """Packs relevance-ordered candidates into one context string.
+
+    Candidates are {"id", "doc", "metadata", "uncovered"} dicts, best first.
+    Duplicate texts and line ranges overlapping an already packed chunk of the
+    same source are skipped, then snippets are added until n_results snippets or
+    token_budget estimated tokens (0 = unlimited). If the next snippet does not
+    fit, it is cut at a line boundary to use the remaining budget. Returns the
+    context and a list of "location (reason)" strings for everything dropped.
+    """
+    kept: List[dict] = []
+    parts: List[str] = []
+    dropped: List[str] = []
+    seen_texts = set()
+    used = 0
+
+    for candidate in candidates:
+        if len(parts) >= n_results:
+            dropped.append(f"{_describe(candidate)} (limit)")
+            continue
+        digest = hashlib.sha1(candidate['doc'].encode('utf-8')).hexdigest()
+        if digest in seen_texts:
+            dropped.append(f"{_describe(candidate)} (duplicate)")
+            continue
+        if _overlaps(candidate, kept):
+            dropped.append(f"{_describe(candidate)} (overlap)")
+            continue
+
+        snippet = format_snippet(candidate['doc'], candidate['metadata'], candidate.get('uncovered'))
+        cost = estimate_tokens(snippet) + (estimate_tokens(SNIPPET_SEPARATOR) if parts else 0)
+        if token_budget and used + cost > token_budget:
+            remaining = token_budget - used - (estimate_tokens(SNIPPET_SEPARATOR) if parts else 0)
+            partial = _truncate_snippet(candidate, remaining)
+            if partial is None:
+                dropped.append(f"{_describe(candidate)} (budget)")
+                continue
+            snippet = partial
+            cost = token_budget - used
+            dropped.append(f"{_describe(candidate)} (truncated)")
+
+        parts.append(snippet)
+        kept.append(candidate)
+        seen_texts.add(digest)
+        used += cost
+
+    return SNIPPET_SEPARATOR.join(parts), dropped
+
+
+def _summarize_dropped(dropped: List[str]) -> str:
+    """Names duplicate, overlapping and truncated chunks; only counts the ones cut by the limits."""
+    named = [d for d in dropped if not d.endswith(("(limit)", "(budget)"))]
+    over_budget = sum(d.endswith("(budget)") for d in dropped)
+    over_limit = sum(d.endswith("(limit)") for d in dropped)
+    parts = []
+    if named:
+        parts.append(f"dropped {', '.join(named)}")
+    if over_budget:
+        parts.append(f"{over_budget} over token budget")
+    if over_limit:
+        parts.append(f"{over_limit} beyond n_results")
+    return "; ".join(parts)
+
+
+def _truncate_snippet(candidate: dict, token_limit: int):
+    """Longest line-aligned prefix of the snippet that fits token_limit, or None if too small."""
+    if token_limit < MIN_PARTIAL_TOKENS:
+        return None
+    lines = candidate['doc'].splitlines(keepends=True)
+    while lines:
+        lines.pop()
+        snippet = format_snippet(''.join(lines), candidate['metadata'], candidate.get('uncovered'), truncated=True)
+        if lines and estimate_tokens(snippet) <= token_limit:
+            return snippet
+    return None
+
+
+def retrieve_contexts(client: chromadb.Collection, queries: List[str], n_results: int = N_RESULTS,
+                      manifest_path: str = MANIFEST_PATH, lexical_weight: float = LEXICAL_WEIGHT,
+                      vector_weight: float = VECTOR_WEIGHT, rrf_k: int = RRF_K,
+                      token_budget: int = TOKEN_BUDGET, paths: List[str] = None, symbols: List[str] = None,
+                      kinds: List[str] = None, auto_scope: bool = AUTO_SCOPE) -> List[str]:
+    """Returns, per query, the snippets containing uncovered lines topped up by hybrid search.
+
+    Lines in an LCOV miss list are resolved to their enclosing chunks through the
+    manifest's line ranges, which needs no embedding call. Queries that end up with
+    fewer than n_results chunks are filled from a BM25 ranking and a vector
+    ranking merged by weighted reciprocal rank fusion. All their texts go through
+    one vector search, so they are embedded in a single batched request; with
+    vector_weight=0 no embedding happens at all. The ordered candidates are then
+    packed into at most n_results snippets and token_budget tokens.
+
+    The top-up search can be limited to source path globs, symbols and file kinds
+    (header/implementation/test/other); both rankings only consider chunks that
+    pass. Without explicit filters and with auto_scope, a miss-list query is
+    limited to non-test files in the directories of its uncovered chunks.
+    """
+    return search_stores([(client, manifest_path)], queries, n_results, lexical_weight, vector_weight, rrf_k,
+                         token_budget, paths=paths, symbols=symbols, kinds=kinds, auto_scope=auto_scope)
+
+
+def search_stores(stores: List[Tuple[chromadb.Collection, str]], queries: List[str], n_results: int,
+                  lexical_weight: float, vector_weight: float, rrf_k: int, token_budget: int,
+                  embed=None, map_stores=None, paths: List[str] = None, symbols: List[str] = None,
+                  kinds: List[str] = None, auto_scope: bool = AUTO_SCOPE) -> List[str]:
+    """retrieve_contexts over several (collection, manifest path) stores, e.g. the shards of an index.
+
+    Each store is searched on its own (through map_stores, e.g. a thread pool's
+    map); vector hits are then merged by distance and BM25 hits by score. BM25
+    scores use document frequencies and lengths summed over all stores, so both
+    rankings, their fusion and the top-k are the same as for one unsharded
+    index. With embed, the queries are embedded once here instead of once per
+    store.
+    """
+    map_stores = map_stores or (lambda fn, items: list(map(fn, items)))
+    candidates: List[List[dict]] = [[] for _ in queries]
+    for store_hits in map_stores(lambda store: direct_candidates(store[0], queries, store[1]), stores):
+        for i, hits in enumerate(store_hits):
+            candidates[i].extend(hits)
+    for i, query in enumerate(queries):
+        misses = parse_miss_list(query)
+        if misses:
+            # Most uncovered lines first, across stores
+            candidates[i].sort(key=lambda c: -len(c['uncovered']))
+            print(f"Resolved {len(misses)} uncovered lines to {len(candidates[i])} snippets directly.")
+
+    filters = {name: list(values) for name, values in (("paths", paths), ("symbols", symbols), ("kinds", kinds))
+               if values}
+    scopes = [filters or (scope_from_misses(candidates[i]) if auto_scope and candidates[i] else None)
+              for i in range(len(queries))]
+    pending = [i for i in range(len(queries)) if len(candidates[i]) < n_results]
+    # Over-fetch so chunks already selected, duplicates and overlaps can be skipped
+    depth = max([CANDIDATE_DEPTH] + [n_results + len(candidates[i]) for i in pending])
+    # Queries with the same filters share one search per store
+    groups: Dict[str, List[int]] = {}
+    for i in pending:
+        groups.setdefault(json.dumps(scopes[i], sort_keys=True), []).append(i)
+    corpus = None
+    if pending and lexical_weight > 0 and len(stores) > 1:
+        # Per-store IDFs and average lengths differ, which would make shard scores incomparable
+        terms = {term for i in pending for term in query_terms(queries[i])}
+        corpus = merge_corpus_stats(map_stores(lambda store: load_lexical_index(store[1]).corpus_stats(terms),
+                                               stores))
+    embeddings = {}
+    if pending and vector_weight > 0 and (embed is not None or len(groups) > 1):
+        # Still a single embedding request when the queries are split across filters
+        embed = embed or get_embedding_function(for_chroma=False)
+        embeddings = dict(zip(pending, embed([queries[i] for i in pending])))
+    for members in groups.values():
+        texts = [queries[i] for i in members]
+        group_embeddings = [embeddings[i] for i in members] if embeddings else None
+        scope = scopes[members[0]]
+        rankings = map_stores(lambda store: rank_store(store[0], store[1], texts, group_embeddings, depth,
+                                                       lexical_weight, vector_weight, scope, corpus), stores)
+        for slot, i in enumerate(members):
+            per_store = [store_rankings[slot] for store_rankings in rankings]
+            vector = sorted((hit for r in per_store for hit in r["vector"]), key=lambda hit: (hit[1], hit[0]))
+            lexical = sorted((hit for r in per_store for hit in r["lexical"]), key=lambda hit: (-hit[1], hit[0]))
+            snippets = {chunk: snippet for r in per_store for chunk, snippet in r["docs"].items()}
+            fused = reciprocal_rank_fusion([([c for c, _ in vector[:depth]], vector_weight),
+                                            ([c for c, _ in lexical[:depth]], lexical_weight)], rrf_k)
+            already = {c['id'] for c in candidates[i]}
+            for chunk in [c for c in fused if c not in already][:depth]:
+                if chunk in snippets:
+                    doc, metadata = snippets[chunk]
+                    candidates[i].append({"id": chunk, "doc": doc, "metadata": metadata, "uncovered": None})
+
+    contexts = []
+    for i, query_candidates in enumerate(candidates):
+        context, dropped = pack_snippets(query_candidates, n_results, token_budget)
+        # Candidates beyond n_results are routine; report only real packing decisions
+        if any(not d.endswith("(limit)") for d in dropped):
+            print(f"Query {i}: packed ~{estimate_tokens(context) if context else 0} tokens; "
+                  f"{_summarize_dropped(dropped)}")
+        contexts.append(context)
+    return contexts
+
+
+def direct_candidates(client: chromadb.Collection, queries: List[str], manifest_path: str) -> List[List[dict]]:
+    """Per query, the chunks of this store that contain lines of the query's miss list."""
+    candidates: List[List[dict]] = [[] for _ in queries]
+    line_index = None
+    for i, query in enumerate(queries):
+        misses = parse_miss_list(query)
+        if not misses:
+            continue
+        if line_index is None:
+            line_index = load_manifest_index(manifest_path)[1]
+        hits = line_index.resolve(misses)
+        if hits:
+            found = client.get(ids=list(hits), include=['documents', 'metadatas'])
+            by_id = {c: (doc, meta) for c, doc, meta in zip(found['ids'], found['documents'], found['metadatas'])}
+            for chunk, lines in hits.items():
+                if chunk in by_id:
+                    doc, metadata = by_id[chunk]
+                    candidates[i].append({"id": chunk, "doc": doc, "metadata": metadata, "uncovered": lines})
+    return candidates
+
+
+def rank_store(client: chromadb.Collection, manifest_path: str, queries: List[str], query_embeddings,
+               depth: int, lexical_weight: float, vector_weight: float, filters: dict = None,
+               corpus: CorpusStats = None) -> List[dict]:
+    """Per query, this store's vector hits [(id, distance)], BM25 hits [(id, score)] and their texts.
+
+    corpus overrides the BM25 statistics of this store's lexical index (see search_stores).
+    """
+    rankings = [{"vector": [], "lexical": [], "docs": {}} for _ in queries]
+    where, allowed = (resolve_filters(client, load_manifest_index(manifest_path)[0], filters) if filters
+                      else (None, None))
+    if allowed is not None and not allowed:
+        return rankings
+    size = client.count() if allowed is None else min(len(allowed), client.count())
+    if vector_weight > 0 and size:
+        # Without precomputed embeddings the client's EF embeds all queries in one batch
+        query = {"query_embeddings": query_embeddings} if query_embeddings is not None else {"query_texts": queries}
+        if where:
+            query["where"] = where
+        results = client.query(n_results=min(depth, size), **query)
+        if results and results.get('documents'):
+            for ranking, ids, docs, metadatas, distances in zip(rankings, results['ids'], results['documents'],
+                                                                 results['metadatas'], results['distances']):
+                ranking["vector"] = list(zip(ids, distances))
+                ranking["docs"].update(zip(ids, zip(docs, metadatas)))
+    if lexical_weight > 0:
+        lexical = load_lexical_index(manifest_path)
+        for ranking, query in zip(rankings, queries):
+            ranking["lexical"] = lexical.search(query, depth, allowed, corpus)
+
+    # Lexical-only hits still need their text; a chunk may be another query's vector hit
+    snippets = {c: snippet for r in rankings for c, snippet in r["docs"].items()}
+    missing = sorted({c for r in rankings for c, _ in r["lexical"]} - set(snippets))
+    if missing:
+        found = client.get(ids=missing, include=['documents', 'metadatas'])
+        snippets.update(zip(found['ids'], zip(found['documents'], found['metadatas'])))
+    for ranking in rankings:
+        ranking["docs"].update((c, snippets[c]) for c, _ in ranking["lexical"] if c in snippets)
+    return rankings
+
+
+def retrieve_context(client: chromadb.Collection, query: str, n_results: int = N_RESULTS,
+                     manifest_path: str = MANIFEST_PATH) -> str:
+    """Returns the snippets for a single query (see retrieve_contexts)."""
+    print(f"Searching for context related to: {query[:50]}...")
+    return retrieve_contexts(client, [query], n_results, manifest_path)[0]
+
+
+def read_query_file(path: str) -> List[dict]:
+    """Reads a JSONL file of {"query": ..., "id": optional, "output": optional} objects."""
+    items = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if not isinstance(item, dict) or not isinstance(item.get('query'), str):
+                raise ValueError(f"{path}:{line_number}: expected an object with a 'query' string")
+            item.setdefault('id', str(len(items)))
+            items.append(item)
+    return items
+
+
+def retrieve_batch(finder, query_file: str, output: str = None, n_results: int = N_RESULTS,
+                   **search_options) -> None:
+    """Answers every query in a JSONL file with one retrieval pass.
+
+    Items with an "output" key get their context written to that file; if output
+    is given, all results are also written there as JSONL ({"id", "context"}).
+    """
+    items = read_query_file(query_file)
+    print(f"Retrieving context for {len(items)} queries...")
+    contexts = finder.retrieve([item['query'] for item in items], n_results, **search_options)
+
+    for item, context in zip(items, contexts):
+        if item.get('output'):
+            with open(item['output'], 'w', encoding='utf-8') as f:
+                f.write(context)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            for item, context in zip(items, contexts):
+                f.write(json.dumps({"id": item['id'], "context": context}) + "\n")
+
+
+def search_options_from(values: dict) -> dict:
+    """Picks the retrieve_contexts tuning options out of CLI args or a server request."""
+    options = {}
+    for name, cast in (("lexical_weight", float), ("vector_weight", float), ("rrf_k", int), ("token_budget", int)):
+        if values.get(name) is not None:
+            options[name] = cast(values[name])
+    for name in ("paths", "symbols", "kinds"):
+        if values.get(name):
+            if isinstance(values[name], str):
+                raise ValueError(f"{name} must be a list")
+            options[name] = sorted({str(value) for value in values[name]})
+    unknown = set(options.get("kinds", [])) - set(FILE_KINDS)
+    if unknown:
+        raise ValueError(f"unknown file kinds {', '.join(sorted(unknown))}; expected {', '.join(FILE_KINDS)}")
+    if values.get("auto_scope") is not None:
+        options["auto_scope"] = bool(values["auto_scope"])
+    return options
+
+
+class LocalContextFinder:
+    """Indexes and retrieves in this process; the collection is opened on first use.
+
+    With a base_collection, the collection is a copy-on-write overlay of it (see
+    overlay_collection.py): indexing stores only the files that differ from the
+    base, and searches see the base merged with those overrides.
+    """
+
+    def __init__(self, embed_batch_size: int = EMBED_BATCH_SIZE, backend: str = VECTOR_BACKEND,
+                 vector_dtype: str = VECTOR_DTYPE, collection: str = COLLECTION_NAME, base_collection: str = None,
+                 use_query_cache: bool = True):
+        self.use_query_cache = use_query_cache
+        self.embed_batch_size = embed_batch_size
+        self.backend = backend
+        self.vector_dtype = vector_dtype
+        self.collection_name = collection
+        self.base_collection = base_collection if base_collection != collection else None
+        self.manifest_path = get_manifest_path(backend, collection, vector_dtype)
+        self.base_manifest_path = (get_manifest_path(backend, self.base_collection, vector_dtype)
+                                   if self.base_collection else None)
+        self._collection = None
+        self._index_lock = threading.Lock()
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            overlay = get_db_client(embed_batch_size=self.embed_batch_size, backend=self.backend,
+                                    vector_dtype=self.vector_dtype, collection=self.collection_name)
+            if self.base_collection:
+                from overlay_collection import OverlayCollection
+
+                base = get_db_client(embed_batch_size=self.embed_batch_size, backend=self.backend,
+                                     vector_dtype=self.vector_dtype, collection=self.base_collection)
+                state_path = os.path.splitext(self.manifest_path)[0] + "_overlay.json"
+                overlay = OverlayCollection(base, overlay, state_path,
+                                            get_embedding_function(batch_size=self.embed_batch_size, for_chroma=False),
+                                            base_name=self.base_collection)
+            self._collection = overlay
+        return self._collection
+
+    def index(self, files: List[str], root: str = None) -> dict:
+        # Manifest read-modify-write must not interleave between server requests
+        with self._index_lock:
+            if self.base_collection:
+                sync_branch_manifest(self.manifest_path, self.base_manifest_path, self.collection.shadowed)
+            return index_codebase(self.collection, files, manifest_path=self.manifest_path, root=root)
+
+    def index_version(self) -> str:
+        """Changes whenever the indexed contents this collection serves change."""
+        versions = [read_index_version(self.manifest_path)]
+        if self.base_collection:
+            versions.append(read_index_version(self.base_manifest_path))
+        return "/".join(versions)
+
+    def warm(self) -> None:
+        self.collection
+
+    def retrieve(self, queries: List[str], n_results: int = N_RESULTS, **search_options) -> List[str]:
+        namespace = f"{self.backend}:{self.vector_dtype}:{self.manifest_path}"
+        return cached_retrieve(self, namespace, queries, n_results, search_options,
+                               lambda missing: retrieve_contexts(self.collection, missing, n_results,
+                                                                 manifest_path=self.manifest_path, **search_options))
+
+
+class ShardedContextFinder:
+    """One LocalContextFinder (collection + manifest) per top-level directory of the indexed paths.
+
+    The shard of a path is its first shard_depth directories ("_root" for files
+    above them). Indexing can be limited to some shards, leaving the others
+    untouched; retrieval searches all shards concurrently and merges the results
+    into one global top-k. Known shards are listed in <collection>_shards.json.
+    """
+
+    def __init__(self, shard_depth: int, embed_batch_size: int = EMBED_BATCH_SIZE, backend: str = VECTOR_BACKEND,
+                 vector_dtype: str = VECTOR_DTYPE, collection: str = COLLECTION_NAME, base_collection: str = None,
+                 use_query_cache: bool = True):
+        self.shard_depth = shard_depth
+        self.embed_batch_size = embed_batch_size
+        self.backend = backend
+        self.vector_dtype = vector_dtype
+        self.collection_name = collection
+        self.base_collection = base_collection
+        self.use_query_cache = use_query_cache
+        self.registry_path = os.path.join(DB_PATH, f"{collection}_shards.json")
+        self._shards: Dict[str, LocalContextFinder] = {}
+        self._lock = threading.Lock()
+        self._embedding_fn = None
+
+    def shard_of(self, path: str) -> str:
+        parts = os.path.normpath(path).split(os.sep)
+        return "/".join(parts[:self.shard_depth]) if len(parts) > self.shard_depth else "_root"
+
+    def shard(self, name: str) -> LocalContextFinder:
+        with self._lock:
+            if name not in self._shards:
+                suffix = "--shard-" + re.sub(r'[^A-Za-z0-9_-]+', '-', name).strip('-')
+                base = self.base_collection + suffix if self.base_collection else None
+                self._shards[name] = LocalContextFinder(self.embed_batch_size, self.backend, self.vector_dtype,
+                                                        collection=self.collection_name + suffix,
+                                                        base_collection=base, use_query_cache=False)
+            return self._shards[name]
+
+    def shard_names(self) -> List[str]:
+        try:
+            with open(self.registry_path, 'r', encoding='utf-8') as f:
+                return json.load(f)["shards"]
+        except (OSError, ValueError, KeyError):
+            return []
+
+    def _save_shard_names(self, names: List[str]) -> None:
+        os.makedirs(os.path.dirname(self.registry_path) or ".", exist_ok=True)
+        with open(f"{self.registry_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump({"shard_depth": self.shard_depth, "shards": sorted(names)}, f)
+        os.replace(f"{self.registry_path}.tmp", self.registry_path)
+
+    def warm(self) -> None:
+        for name in self.shard_names():
+            self.shard(name).warm()
+
+    def index(self, files: List[str], root: str = None, shards: List[str] = None) -> dict:
+        """Indexes each shard's share of files; with shards, only those shards are touched."""
+        groups: Dict[str, List[str]] = {}
+        for path in files:
+            groups.setdefault(self.shard_of(path), []).append(path)
+        known = self.shard_names()
+        # Known shards without files in this run lose their files, like any removed file
+        names = sorted(set(known) | set(groups))
+        if shards:
+            names = [name for name in names if name in shards]
+        totals = dict.fromkeys(("changed", "unchanged", "removed", "upserted", "deleted"), 0)
+        for name in names:
+            print(f"[shard {name}]")
+            stats = self.shard(name).index(groups.get(name, []), root=root)
+            for key in totals:
+                totals[key] += stats[key]
+        registered = set(known) | set(names)
+        self._save_shard_names(sorted(registered))
+        totals["total"] = sum(self.shard(name).collection.count() for name in sorted(registered))
+        totals["shards"] = len(registered)
+        print(f"Indexed {totals['total']} total snippets in {len(registered)} shards.")
+        return totals
+
+    def index_version(self) -> str:
+        return "/".join(f"{name}={self.shard(name).index_version()}" for name in self.shard_names())
+
+    def retrieve(self, queries: List[str], n_results: int = N_RESULTS, **search_options) -> List[str]:
+        namespace = f"{self.backend}:{self.vector_dtype}:{self.registry_path}"
+        return cached_retrieve(self, namespace, queries, n_results, search_options,
+                               lambda missing: self._search(missing, n_results, **search_options))
+
+    def _search(self, queries: List[str], n_results: int, lexical_weight: float = LEXICAL_WEIGHT,
+                vector_weight: float = VECTOR_WEIGHT, rrf_k: int = RRF_K,
+                token_budget: int = TOKEN_BUDGET, **filters) -> List[str]:
+        from concurrent.futures import ThreadPoolExecutor
+
+        shards = [self.shard(name) for name in self.shard_names()]
+        if self._embedding_fn is None:
+            self._embedding_fn = get_embedding_function(batch_size=self.embed_batch_size, for_chroma=False)
+        stores = [(shard.collection, shard.manifest_path) for shard in shards]
+        with ThreadPoolExecutor(max_workers=max(1, min(len(stores), SHARD_QUERY_WORKERS))) as pool:
+            return search_stores(stores, queries, n_results, lexical_weight, vector_weight, rrf_k, token_budget,
+                                 embed=self._embedding_fn, map_stores=lambda fn, items: list(pool.map(fn, items)),
+                                 **filters)
+
+
+def cached_retrieve(finder, namespace: str, queries: List[str], n_results: int, search_options: dict,
+                    search) -> List[str]:
+    """Answers queries from the query cache and runs search(missing_queries) for the rest."""
+    cache = get_query_cache() if finder.use_query_cache else None
+    if cache is None:
+        return search(queries)
+
+    # Hits never open the collection, so neither the vector store nor the embedding client loads
+    options = {"lexical_weight": LEXICAL_WEIGHT, "vector_weight": VECTOR_WEIGHT, "rrf_k": RRF_K,
+               "token_budget": TOKEN_BUDGET, "auto_scope": AUTO_SCOPE, **search_options}
+    version = finder.index_version()
+    keys = [QueryCache.make_key(namespace, query, n_results, options) for query in queries]
+    found = cache.get_many(keys, version)
+    missing = [i for i, key in enumerate(keys) if key not in found]
+    if missing:
+        contexts = search([queries[i] for i in missing])
+        fresh = {keys[i]: context for i, context in zip(missing, contexts)}
+        cache.put_many(namespace, version, fresh)
+        found.update(fresh)
+    print(cache.report())
+    return [found[key] for key in keys]
+
+
+class RemoteContextFinder:
+    """Thin client for a context server started with 'serve' mode.
+
+    If the server cannot be reached (e.g. it stopped after find_context_server
+    saw it), requests go to the finder built by fallback instead, if given.
+    """
+
+    def __init__(self, address: str = RAG_SERVER_ADDRESS, fallback=None):
+        self.address = address
+        self.base_url = f"http://{address}"
+        self.fallback = fallback
+        self.token = read_server_token(server_token_path(address))
+        self._local = None
+
+    def _local_finder(self, error: Exception):
+        if self._local is None:
+            reason = getattr(error, "reason", error)
+            if self.fallback is None:
+                raise RuntimeError(f"Context server at {self.address} is unreachable: {reason}") from error
+            print(f"Warning: context server at {self.address} is unreachable ({reason}); "
+                  f"working in this process.", file=sys.stderr)
+            self._local = self.fallback()
+        return self._local
+
+    def _post(self, path: str, payload: dict) -> dict:
+        """POSTs payload; HTTP errors become RuntimeError, connection errors stay urllib.error.URLError."""
+        import urllib.error
+        import urllib.request
+
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["X-Context-Token"] = self.token
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=json.dumps(payload).encode('utf-8'),
+            headers=headers,
         )
-        print(f"Indexed {client.count()} total snippets.")
+        try:
+            # Indexing can take minutes, so no timeout here
+            with urllib.request.urlopen(request) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            detail = json.loads(e.read() or b'{}').get('error', e.reason)
+            raise RuntimeError(f"Context server error: {detail}") from e
+
+    def index(self, files: List[str], root: str = None, shards: List[str] = None) -> dict:
+        import urllib.error
+
+        payload = {"files": files, "root": root or os.getcwd()}
+        if shards:
+            payload["shards"] = shards
+        options = {"shards": shards} if shards else {}
+        if self._local is not None:
+            return self._local.index(files, root=payload["root"], **options)
+        try:
+            stats = self._post("/index", payload)
+        except urllib.error.URLError as e:
+            return self._local_finder(e).index(files, root=payload["root"], **options)
+        print(f"Files: {stats['changed']} changed, {stats['unchanged']} unchanged, {stats['removed']} removed "
+              f"({stats['upserted']} snippets upserted, {stats['deleted']} deleted).")
+        print(f"Indexed {stats['total']} total snippets.")
+        return stats
+
+    def retrieve(self, queries: List[str], n_results: int = N_RESULTS, **search_options) -> List[str]:
+        import urllib.error
+
+        if self._local is not None:
+            return self._local.retrieve(queries, n_results, **search_options)
+        payload = {"queries": queries, "n_results": n_results, "options": search_options}
+        try:
+            return self._post("/retrieve", payload)["contexts"]
+        except urllib.error.URLError as e:
+            return self._local_finder(e).retrieve(queries, n_results, **search_options)
+
+
+def _split_address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(':')
+    return host or "127.0.0.1", int(port)
+
+
+def server_token_path(address: str) -> str:
+    """Where the server on this address keeps the token its clients must send to /index and /shutdown."""
+    return os.path.join(DB_PATH, f"context_server_{_split_address(address)[1]}.token")
+
+
+def write_server_token(path: str) -> str:
+    """Writes a new random token to path, readable by this user only, and returns it."""
+    import secrets
+
+    token = secrets.token_hex(32)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    try:
+        # os.open keeps the mode of an existing file, so start from a fresh one
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w', encoding='utf-8') as f:
+        f.write(token)
+    return token
+
+
+def read_server_token(path: str) -> Optional[str]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def find_context_server(address: str = RAG_SERVER_ADDRESS, backend: str = VECTOR_BACKEND,
+                        vector_dtype: str = VECTOR_DTYPE, collection: str = COLLECTION_NAME,
+                        shard_depth: int = SHARD_DEPTH, fallback=None):
+    """Returns a RemoteContextFinder if a server for this DB_PATH/collection/backend is listening.
+
+    fallback builds the local finder the client switches to if the server goes away.
+    """
+    import socket
+
+    try:
+        # Cheap refusal check before paying for urllib and an HTTP round-trip
+        socket.create_connection(_split_address(address), timeout=0.2).close()
+        import urllib.request
+        with urllib.request.urlopen(f"http://{address}/health", timeout=2) as response:
+            health = json.loads(response.read())
+    except (OSError, ValueError):
+        return None
+    if (health.get("db_path") != DB_PATH or health.get("collection") != collection
+            or health.get("backend") != backend or health.get("vector_dtype") != vector_dtype
+            or health.get("embedding_model", EMBEDDING_MODEL_NAME) != EMBEDDING_MODEL_ID
+            or health.get("shard_depth", 0) != shard_depth):
+        print(f"Ignoring context server at {address}: it serves a different index.", file=sys.stderr)
+        return None
+    return RemoteContextFinder(address, fallback)
+
+
+def serve(finder, address: str = RAG_SERVER_ADDRESS) -> None:
+    """Keeps the collection and embedding client warm and answers JSON requests over localhost HTTP.
+
+    /index and /shutdown change the server's state, so they need the token
+    written to server_token_path(address) in the X-Context-Token header.
+    """
+    import hmac
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class ContextRequestHandler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, payload: dict) -> None:
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._reply(200, {"status": "ok", "db_path": DB_PATH, "collection": finder.collection_name,
+                                  "backend": finder.backend, "vector_dtype": finder.vector_dtype,
+                                  "embedding_model": EMBEDDING_MODEL_ID,
+                                  "shard_depth": getattr(finder, "shard_depth", 0),
+                                  "ollama_hosts": get_pool(OLLAMA_HOSTS).stats() if EMBEDDER == "ollama" else []})
+            else:
+                self._reply(404, {"error": f"unknown path {self.path}"})
+
+        def do_POST(self):
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                if self.path in ("/index", "/shutdown") and not hmac.compare_digest(
+                        self.headers.get("X-Context-Token", ""), token):
+                    self._reply(403, {"error": f"missing or wrong token (see {token_path})"})
+                elif self.path == "/index":
+                    shards = {"shards": payload["shards"]} if payload.get("shards") else {}
+                    self._reply(200, finder.index(payload["files"], root=payload.get("root"), **shards))
+                elif self.path == "/retrieve":
+                    contexts = finder.retrieve(payload["queries"], int(payload.get("n_results", N_RESULTS)),
+                                               **search_options_from(payload.get("options") or {}))
+                    self._reply(200, {"contexts": contexts})
+                elif self.path == "/shutdown":
+                    self._reply(200, {"status": "stopping"})
+                    threading.Thread(target=server.shutdown, daemon=True).start()
+                else:
+                    self._reply(404, {"error": f"unknown path {self.path}"})
+            except (KeyError, TypeError, ValueError) as e:
+                self._reply(400, {"error": f"bad request: {e}"})
+            except Exception as e:
+                self._reply(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            print(f"[serve] {self.address_string()} {format % args}", file=sys.stderr)
+
+    # Open the collection up front so the first request is already warm
+    finder.warm()
+    server = ThreadingHTTPServer(_split_address(address), ContextRequestHandler)
+    token_path = server_token_path(address)
+    token = write_server_token(token_path)
+    print(f"Context server listening on http://{address} "
+          f"(DB: {DB_PATH}, collection: {finder.collection_name}, backend: {finder.backend})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if read_server_token(token_path) == token:
+            os.remove(token_path)
+
+
+def recall_report(finder: LocalContextFinder, k: int, sample: int, query_file: str = None,
+                  output: str = None) -> List[dict]:
+    """Compares top-k search over float16/int8 storage with exact float32 search on the indexed chunks.
+
+    Full-precision vectors come from the embedding function, so with a warm
+    embedding cache this is a local disk read. Queries are the given JSONL
+    queries, or a fixed-seed sample of the stored chunks themselves.
+    """
+    import numpy as np
+    from numpy_store import quantization_report
+
+    stored = finder.collection.get(include=['documents'])
+    documents = stored.get('documents') or []
+    if not documents:
+        print("Index is empty; nothing to report.")
+        return []
+    ef = get_embedding_function(batch_size=finder.embed_batch_size, for_chroma=False)
+    vectors = np.asarray(ef(documents), dtype=np.float32)
+    if query_file:
+        queries = np.asarray(ef([item['query'] for item in read_query_file(query_file)]), dtype=np.float32)
     else:
-        print("No documents to index.")
+        rows = np.random.default_rng(0).permutation(len(documents))[:sample]
+        queries = vectors[np.sort(rows)]
 
+    report = quantization_report(vectors, queries, k)
+    print(f"Recall@{k} vs float32 over {len(documents)} chunks and {len(queries)} queries:")
+    for row in report:
+        print(f"  {row['dtype']:>8}: recall {row['recall_at_k']:.4f}, {row['bytes_per_vector']:.0f} B/vector, "
+              f"index {row['index_bytes'] / 1024:.1f} KiB, search {row['search_ms']:.2f} ms")
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump({"k": k, "chunks": len(documents), "queries": int(len(queries)), "report": report}, f, indent=2)
+    return report
 
-def retrieve_context(client: chromadb.Collection, query: str) -> str:
-    """Performs a similarity search using the query."""
-    print(f"Searching for context related to: {query[:50]}...")
-    
-    # Client uses the configured Ollama EF to embed the query
-    results = client.query(
-        query_texts=[query],
-        n_results=3  # Retrieve top 3 most relevant snippets
-    )
 
-    context = []
-    if results and results.get('documents'):
-        for docs, metadatas in zip(results['documents'], results['metadatas']):
-            for doc, metadata in zip(docs, metadatas):
-                context.append(f"## Source: {metadata.get('source', 'Unknown')}\n{doc}\n")
-    
-    return "\n---\n".join(context)
+def finder_from_args(args):
+    collection = collection_name(args.repo, args.branch)
+    base = collection_name(args.repo, args.base_branch) if args.branch else None
+    if args.shard_depth > 0:
+        return ShardedContextFinder(args.shard_depth, embed_batch_size=args.embed_batch_size, backend=args.backend,
+                                    vector_dtype=args.vector_dtype, collection=collection, base_collection=base,
+                                    use_query_cache=not args.no_query_cache)
+    return LocalContextFinder(embed_batch_size=args.embed_batch_size, backend=args.backend,
+                              vector_dtype=args.vector_dtype, collection=collection, base_collection=base,
+                              use_query_cache=not args.no_query_cache)
 
 
 def main():
     parser = argparse.ArgumentParser(description="RAG Code Context Finder for Ollama.")
-    parser.add_argument('mode', choices=['index', 'retrieve'], help='Operation mode.')
+    parser.add_argument('mode', choices=['index', 'retrieve', 'retrieve-batch', 'serve', 'recall-report',
+                                         'export', 'import'],
+                        help='Operation mode.')
     parser.add_argument('--files', nargs='*', default=[], help='List of files to index (for index mode).')
     parser.add_argument('--query', help='Query string (LCOV miss list) for retrieval mode.')
-    parser.add_argument('--output', help='File to write retrieved context (for retrieve mode).')
+    parser.add_argument('--queries', help='JSONL file of queries (for retrieve-batch mode).')
+    parser.add_argument('--output', help='File to write retrieved context (for retrieve mode), '
+                                         'JSONL results (for retrieve-batch mode) or JSON (for recall-report).')
+    parser.add_argument('--archive', help='Snapshot .tar.gz to write (export mode) or restore (import mode).')
+    parser.add_argument('--n-results', type=int, default=N_RESULTS,
+                        help='Number of snippets to return (for retrieve mode).')
+    parser.add_argument('--lexical-weight', type=float, default=LEXICAL_WEIGHT,
+                        help='Weight of the BM25 ranking in reciprocal rank fusion (0 disables it).')
+    parser.add_argument('--vector-weight', type=float, default=VECTOR_WEIGHT,
+                        help='Weight of the embedding ranking in reciprocal rank fusion (0 disables it).')
+    parser.add_argument('--rrf-k', type=int, default=RRF_K,
+                        help='Reciprocal rank fusion constant k: score = sum(weight / (k + rank)).')
+    parser.add_argument('--token-budget', type=int, default=TOKEN_BUDGET,
+                        help='Maximum estimated tokens of retrieved context (0 = no limit); '
+                             'combine with a larger --n-results to fill the budget.')
+    parser.add_argument('--path', dest='paths', action='append',
+                        help='Only search chunks of indexed files matching this glob (repeatable).')
+    parser.add_argument('--symbol', dest='symbols', action='append',
+                        help='Only search chunks of this symbol, its members or a qualified tail of it (repeatable).')
+    parser.add_argument('--file-kind', dest='kinds', action='append', choices=FILE_KINDS,
+                        help='Only search chunks of this kind of file (repeatable).')
+    parser.add_argument('--no-auto-scope', dest='auto_scope', action='store_false', default=AUTO_SCOPE,
+                        help='Do not limit miss-list queries to non-test files next to the uncovered lines.')
+    parser.add_argument('--embed-batch-size', type=int, default=EMBED_BATCH_SIZE,
+                        help='Number of texts sent per Ollama embed request.')
+    parser.add_argument('--embedder', choices=['ollama', 'sentence-transformers'], default=EMBEDDER,
+                        help='Embedding backend: the Ollama host, or a sentence-transformers model on local CPU '
+                             '(RAG_ST_MODEL, RAG_ST_THREADS).')
+    parser.add_argument('--backend', choices=['chroma', 'numpy'], default=VECTOR_BACKEND,
+                        help='Vector store backend.')
+    parser.add_argument('--vector-dtype', choices=['float32', 'float16', 'int8'], default=VECTOR_DTYPE,
+                        help='Storage precision of the numpy backend (int8 uses a per-vector scale).')
+    parser.add_argument('--repo', default=RAG_REPO,
+                        help='Repository name; with --branch, selects a per-branch collection.')
+    parser.add_argument('--branch', default=RAG_BRANCH,
+                        help='Branch name (e.g. $BRANCH_NAME in Jenkins); branches other than --base-branch '
+                             'overlay the base branch collection and only index the files that differ.')
+    parser.add_argument('--base-branch', default=RAG_BASE_BRANCH,
+                        help='Branch whose collection seeds the per-branch collections.')
+    parser.add_argument('--shard-depth', type=int, default=SHARD_DEPTH,
+                        help='Split the index into one collection per directory this many levels deep '
+                             '(0 = one collection); retrieval searches the shards concurrently.')
+    parser.add_argument('--shard', nargs='+',
+                        help='With --shard-depth, index mode only updates these shards (e.g. "src").')
+    parser.add_argument('--sample', type=int, default=200,
+                        help='Stored chunks used as queries by recall-report when --queries is not given.')
+    parser.add_argument('--no-query-cache', action='store_true',
+                        help='Always search, without reading or storing cached retrieval results.')
+    parser.add_argument('--server-address', default=RAG_SERVER_ADDRESS,
+                        help='host:port of the context server (serve mode listens there, other modes use it).')
+    parser.add_argument('--no-server', action='store_true',
+                        help='Do not forward to a running context server; work in this process.')
 
     args = parser.parse_args()
+    select_embedder(args.embedder)
     
     # MODIFIED: Removed the check for GEMINI_API_KEY
-    
-    # Initialize client with Ollama Embedding Function
-    client = get_db_client()
 
+    if args.mode == 'serve':
+        serve(finder_from_args(args), args.server_address)
+        return
+    if args.shard_depth > 0 and args.mode in ('recall-report', 'export', 'import'):
+        print(f"Error: {args.mode} mode works on a single collection; run it without --shard-depth.",
+              file=sys.stderr)
+        sys.exit(1)
+    if args.shard and args.shard_depth <= 0:
+        print("Error: --shard needs --shard-depth.", file=sys.stderr)
+        sys.exit(1)
+    if args.mode == 'recall-report':
+        # Always in-process: it needs the raw embeddings, not retrieved text
+        finder = finder_from_args(args)
+        recall_report(finder, args.n_results, args.sample, args.queries, args.output)
+        return
+
+    if args.mode in ('export', 'import'):
+        if not args.archive:
+            print(f"Error: --archive must be provided for {args.mode} mode.", file=sys.stderr)
+            sys.exit(1)
+        collection = collection_name(args.repo, args.branch)
+        if args.mode == 'import' and find_context_server(args.server_address, args.backend, args.vector_dtype,
+                                                         collection):
+            # A running server keeps its own view of the collection and manifest
+            print(f"Error: stop the context server at {args.server_address} before importing.", file=sys.stderr)
+            sys.exit(1)
+        finder = finder_from_args(args)
+        try:
+            if args.mode == 'export':
+                export_index(finder.collection, finder.manifest_path, args.archive)
+            else:
+                import_index(finder.collection, finder.manifest_path, args.archive)
+        except RuntimeError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        return
+
+    # Forward to a warm server if one is running, otherwise open the collection here
+    finder = None
+    if not args.no_server:
+        finder = find_context_server(args.server_address, args.backend, args.vector_dtype,
+                                     collection_name(args.repo, args.branch), args.shard_depth,
+                                     fallback=lambda: finder_from_args(args))
+    if finder is not None:
+        print(f"Using context server at {args.server_address}.")
+    else:
+        finder = finder_from_args(args)
+
+    try:
+        run_mode(finder, args)
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+def run_mode(finder, args) -> None:
     if args.mode == 'index':
         if not args.files:
             print("Error: --files must be provided for index mode.", file=sys.stderr)
             sys.exit(1)
             
-        index_codebase(client, args.files)
+        if args.shard:
+            finder.index(args.files, shards=args.shard)
+        else:
+            finder.index(args.files)
         
     elif args.mode == 'retrieve':
         if not args.query or not args.output:
             print("Error: --query and --output must be provided for retrieve mode.", file=sys.stderr)
             sys.exit(1)
         
-        retrieved_context = retrieve_context(client, args.query)
+        print(f"Searching for context related to: {args.query[:50]}...")
+        retrieved_context = finder.retrieve([args.query], n_results=args.n_results,
+                                            **search_options_from(vars(args)))[0]
         
         with open(args.output, 'w', encoding='utf-8') as f:
             f.write(retrieved_context)
 
+    elif args.mode == 'retrieve-batch':
+        if not args.queries:
+            print("Error: --queries must be provided for retrieve-batch mode.", file=sys.stderr)
+            sys.exit(1)
+
+        try:
+            retrieve_batch(finder, args.queries, args.output, n_results=args.n_results,
+                           **search_options_from(vars(args)))
+        except (OSError, ValueError) as e:
+            print(f"Error reading queries: {e}", file=sys.stderr)
+            sys.exit(1)
+
 
 if __name__ == "__main__":
     main()
-
@@ -1,16 +1,16 @@
 import os
 import sys
+import time
 import argparse
 # Removed: from google import genai
-# Added: Ollama client library
-try:
-    import ollama
-except ImportError:
-    print("Ollama library not found. Please run 'pip install ollama'.", file=sys.stderr)
-    sys.exit(1)
+# The Ollama client library is imported in generate_summary, after argument parsing
+
+from llm_metrics import record_call
+from ollama_pool import get_pool
 
 # --- CONFIGURATION (Customize these) ---
 OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://192.168.1.107:11434")
+OLLAMA_HOSTS = os.environ.get("OLLAMA_HOSTS", OLLAMA_HOST)  # Comma-separated; see ollama_pool.py
 OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "llama3")  # Choose a model you have pulled in Ollama (e.g., mistral, llama3)
 # ----------------------------------------
 
@@ -27,20 +27,21 @@ def generate_summary(input_file, output_file):
         sys.exit(1)
 
     # --- Ollama API Call ---
+    info = {}
+    start = time.time()
+    # User message contains the code
+    user_prompt = f"--- CODE ---\n{code_content}\n--- END CODE ---"
     try:
-        # Initialize the Ollama Client
-        client = ollama.Client(host=OLLAMA_HOST)
+        # Requests go to the least busy of the configured Ollama hosts
+        pool = get_pool(OLLAMA_HOSTS)
         
         # System prompt guides the model's behavior
         system_prompt = ("You are an expert code analyst. Provide a concise, high-level summary (max 100 words) "
                          "of the main class, functions, and data structures defined in the provided C++ code. "
                          "Focus on purpose and external interface, not implementation details.")
                          
-        # User message contains the code
-        user_prompt = f"--- CODE ---\n{code_content}\n--- END CODE ---"
-
         # MODIFIED: Use Ollama's chat interface (best practice for instruction-following models)
-        response = client.chat(
+        response = pool.call(lambda client: client.chat(
             model=OLLAMA_MODEL,
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -50,12 +51,18 @@ def generate_summary(input_file, output_file):
                 "temperature": 0.1, # Keep summarization deterministic
                 "num_ctx": 4096     # Ensure context window is large enough for code
             }
-        )
+        ), info)
+        record_call("summarize_code", "chat", OLLAMA_MODEL, user_prompt, time.time() - start, response,
+                    host=info.get("host", ""), retries=max(info.get("attempts", 1) - 1, 0),
+                    hedged=info.get("hedged", False))
         
         # Ollama's chat response contains the generated text in the 'message' dictionary
         summary_text = response['message']['content'].strip()
         
     except Exception as e:
+        record_call("summarize_code", "chat", OLLAMA_MODEL, user_prompt, time.time() - start,
+                    host=info.get("host", ""), retries=max(info.get("attempts", 1) - 1, 0),
+                    hedged=info.get("hedged", False), error=str(e))
         print(f"Error generating summary via Ollama: {e}", file=sys.stderr)
         # Fallback: return the original content if the API call fails
         summary_text = f"SUMMARY FAILED. ORIGINAL CODE INCLUDED:\n{code_content}"